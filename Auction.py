@@ -1,10 +1,13 @@
 import smartpy as sp
 
+FA2_contract = sp.io.import_script_from_url('file:./FA2.py')
+Payout = sp.io.import_script_from_url('file:./Payout.py')
+Events = sp.io.import_script_from_url('file:./Events.py')
+Stats = sp.io.import_script_from_url('file:./Stats.py')
+
 class Share:
     def get_type(self):
-        t = sp.TRecord(
-            recipient=sp.TAddress,
-            amount=sp.TNat)
+        return Payout.t_share
 
     def make(self, recipient, amount):
         r = sp.record(
@@ -16,55 +19,58 @@ t_list_key = sp.TRecord(
     address =sp.TAddress, token_id=sp.TNat
 ).layout(("address", "token_id"))
 
+# Stored values are right combs and leave out the token, which is already
+# their big_map key; `get_type` is the type of the entry point parameter.
 class ListData:
     def __init__(self):
         self.type_value = sp.TRecord(
+            creator = sp.TAddress,
+            price = sp.TMutez
+        ).right_comb()
+    
+    def get_type(self):
+        return sp.TRecord(
             creator = sp.TAddress,
             token = t_list_key,
-            price = sp.TMutez,
-            shares = Share().get_type()
+            price = sp.TMutez
         )
-    
-    def get_type(self): return self.type_value
 
     def set_type(self): return sp.big_map(l = {}, tkey = t_list_key, tvalue = self.type_value)
 
     def set_value(self, _params):
         return sp.record(
             creator = _params.creator,
-            token = _params.token,
-            price = _params.price,
-            shares = _params.shares
+            price = _params.price
         )
     
 class AuctionData:
     def __init__(self):
         self.type_value = sp.TRecord(
             creator = sp.TAddress,
-            token = sp.TRecord(
-                address = sp.TAddress,
-                token_id = sp.TNat
-                ),
             start_time = sp.TTimestamp,
             end_time = sp.TTimestamp,
             current_price = sp.TMutez,
-            highest_bidder = sp.TAddress,
-            shares = Share().get_type()
-        )
+            highest_bidder = sp.TOption(sp.TAddress)
+        ).right_comb()
     
-    def get_type(self): return self.type_value
+    def get_type(self):
+        return sp.TRecord(
+            creator = sp.TAddress,
+            token = t_list_key,
+            start_time = sp.TTimestamp,
+            end_time = sp.TTimestamp,
+            current_price = sp.TMutez
+        )
 
     def set_type(self): return sp.big_map(l = {}, tkey = t_list_key, tvalue = self.type_value)
 
     def set_value(self, _params):
         return sp.record(
             creator = _params.creator,
-            token = _params.token,
             start_time = _params.start_time,
             end_time = _params.end_time,
             current_price = _params.current_price,
-            highest_bidder = _params.highest_bidder,
-            shares = _params.shares
+            highest_bidder = sp.none
         )
 
 class Batch_transfer:
@@ -86,7 +92,9 @@ class Batch_transfer:
 
 
 class Auction(sp.Contract):
-    def __init__(self, mods, fund_operator):
+    def __init__(self, mods, fund_operator, lazy_entry_points = False):
+        if lazy_entry_points:
+            self.add_flag("lazy-entry-points")
         self.init(
             # metadata = metadata,
             mods = sp.set(mods),
@@ -94,6 +102,10 @@ class Auction(sp.Contract):
             lists = ListData().set_type(),
             auctions = AuctionData().set_type(),
             platform_fees = sp.nat(20000),
+            accrued_fees = sp.mutez(0),
+            balances = sp.big_map(tkey = sp.TAddress, tvalue = sp.TMutez),
+            accrue_payouts = sp.bool(False),
+            collection_stats = sp.big_map(tkey = sp.TAddress, tvalue = Stats.t_stats),
             pause = sp.bool(False)
         )
         
@@ -130,7 +142,7 @@ class Auction(sp.Contract):
         sp.set_type(_moderator, sp.TAddress)
         sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
         self.data.mods.add(_moderator)
-        sp.emit(sp.record(moderator=_moderator),tag="MODERATOR_ADDED")
+        Events.moderator("MODERATOR_ADDED", _moderator)
         
     @sp.entry_point
     def remove_moderator(self, _moderator):
@@ -138,7 +150,7 @@ class Auction(sp.Contract):
         sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
         sp.verify(self.data.mods.contains(_moderator), "ADDRESS_NAT_MODERATOR")
         self.data.mods.remove(_moderator)
-        sp.emit(sp.record(moderator=_moderator),tag="MODERATOR_REMOVED")
+        Events.moderator("MODERATOR_REMOVED", _moderator)
     
     @sp.entry_point
     def update_platform_fees(self, platform_fees):
@@ -146,16 +158,12 @@ class Auction(sp.Contract):
         sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
         sp.verify(platform_fees < 1000000, "INVALID_SHARES")
         self.data.platform_fees = platform_fees
-        sp.emit(sp.record(platform_fees=platform_fees),tag="UPDATE_PLATFORM_FEES")
+        Events.platform_fees("UPDATE_PLATFORM_FEES", platform_fees)
     @sp.entry_point
     def put_on_sale(self, _params):
         sp.set_type(_params, ListData().get_type())
         sp.verify(_params.creator == sp.sender, "INVALID_CREATOR")
         sp.verify(~ self.data.lists.contains(_params.token), "ALREADY_LISTED")
-        total_shares = sp.local("total_shares", self.data.platform_fees)
-        sp.for txn in _params.shares:
-            total_shares.value += txn.amount
-        sp.verify(total_shares.value < 1000000, "INVALID_SHARES")
         self.data.lists[_params.token] = ListData().set_value(_params)
         params = [
                 Batch_transfer.item(from_=sp.sender,
@@ -166,58 +174,50 @@ class Auction(sp.Contract):
                                        ])
             ]
         self.transfer_token(_params.token.address, params)
-        sp.emit(sp.record(token=_params.token.address,token_id=_params.token.token_id),tag="LIST_CREATED")
+        Events.order("LIST_CREATED", sp.none, _params.token, _params.creator, _params.price, 1)
     
     @sp.entry_point
     def collect(self, params):
         sp.set_type(params, t_list_key)
-        sp.verify(self.data.lists.contains(params), "INVALID_LISTED")
-        sp.verify(sp.amount == self.data.lists[params].price, "INFUFFICIENT_VALUE")
+        listing = sp.local("listing", self.data.lists.get_opt(params).open_some("INVALID_LISTED"))
+        sp.verify(sp.amount == listing.value.price, "INFUFFICIENT_VALUE")
+        del self.data.lists[params]
         _params = [
                 Batch_transfer.item(from_=sp.self_address,
                                        txs=[
                                            sp.record(to_=sp.sender,
                                                      amount=1,
-                                                     token_id=self.data.lists[params].token.token_id)
+                                                     token_id=params.token_id)
                                        ])
             ]
-        self.transfer_token(self.data.lists[params].token.address, _params)
-        transfer_amount = sp.local("transfer_amount", self.data.lists[params].price)
-        sp.send(self.data.fund_operator, sp.split_tokens(transfer_amount.value, self.data.platform_fees, 1000000))
-        transfer_amount.value = transfer_amount.value - sp.split_tokens(transfer_amount.value, self.data.platform_fees, 1000000)
-        sp.for txn in self.data.lists[params].shares:
-            sp.send(txn.recipient, sp.split_tokens(transfer_amount.value, txn.amount, 1000000))
-            transfer_amount.value = transfer_amount.value - sp.split_tokens(transfer_amount.value, txn.amount, 1000000)
-        sp.send(self.data.lists[params].creator, transfer_amount.value)
-        del self.data.lists[params]
-        sp.emit(sp.record(token=params,tag="TOKEN_COLLECTED"))
+        self.transfer_token(params.address, _params)
+        payout = sp.local("sale_payout", Payout.pay_out(self.data, listing.value.price, params, listing.value.creator))
+        Stats.record_sale(self.data.collection_stats, params.address, listing.value.price, 1)
+        Events.sale("TOKEN_COLLECTED", sp.none, params, listing.value.creator, sp.sender,
+                    listing.value.price, 1, 0, payout.value)
 
     @sp.entry_point
     def cancel_sale(self, params):
         sp.set_type(params, t_list_key)
-        sp.verify(self.data.lists.contains(params), "UNLISTED")
-        sp.verify(self.data.lists[params].creator == sp.sender, "INVALID_CREATOR")
+        listing = sp.local("listing", self.data.lists.get_opt(params).open_some("UNLISTED"))
+        sp.verify(listing.value.creator == sp.sender, "INVALID_CREATOR")
+        del self.data.lists[params]
         _params = [
                 Batch_transfer.item(from_=sp.self_address,
                                        txs=[
-                                           sp.record(to_=self.data.lists[params].creator,
+                                           sp.record(to_=listing.value.creator,
                                                      amount=1,
-                                                     token_id=self.data.lists[params].token.token_id)
+                                                     token_id=params.token_id)
                                        ])
             ]
-        self.transfer_token(self.data.lists[params].token.address, _params)
-        del self.data.lists[params]
-        sp.emit(sp.record(token=params.address,token_id=params.token_id),tag="LIST_CANCELED")
+        self.transfer_token(params.address, _params)
+        Events.order("LIST_CANCELED", sp.none, params, sp.sender, listing.value.price, 0)
 
     @sp.entry_point
     def create_auction(self, _params):
         sp.set_type(_params, AuctionData().get_type())
         sp.verify(_params.creator == sp.sender, "INVALID_CREATOR")
         sp.verify(~ self.data.auctions.contains(_params.token), "ALREADY_CREATED")
-        total_shares = sp.local("total_shares", self.data.platform_fees)
-        sp.for txn in _params.shares:
-            total_shares.value += txn.amount
-        sp.verify(total_shares.value < 1000000, "INVALID_SHARES")
         self.data.auctions[_params.token] = AuctionData().set_value(_params)
         params = [
                 Batch_transfer.item(from_=sp.sender,
@@ -228,72 +228,164 @@ class Auction(sp.Contract):
                                        ])
             ]
         self.transfer_token(_params.token.address, params)
-        sp.emit(sp.record(token=_params.token.address,token_id=_params.token.token_id),tag="AUCTION_CREATED")
+        Events.order("AUCTION_CREATED", sp.none, _params.token, _params.creator, _params.current_price, 1)
 
     @sp.entry_point
     def cancel_auction(self, params):
         sp.set_type(params, t_list_key)
-        sp.verify(self.data.auctions.contains(params), "INVALID_AUCTION")
-        sp.verify(self.data.auctions[params].creator == sp.sender, "INVALID_CREATOR")
-        sp.if self.data.auctions[params].current_price > sp.tez(0):
-            sp.send(self.data.auctions[params].highest_bidder, self.data.auctions[params].current_price)
+        auction = sp.local("auction", self.data.auctions.get_opt(params).open_some("INVALID_AUCTION"))
+        sp.verify(auction.value.creator == sp.sender, "INVALID_CREATOR")
+        del self.data.auctions[params]
+        sp.if auction.value.highest_bidder.is_some():
+            Payout.refund(self.data, auction.value.highest_bidder.open_some(), auction.value.current_price)
         _params = [
                 Batch_transfer.item(from_=sp.self_address,
                                        txs=[
-                                           sp.record(to_=self.data.auctions[params].creator,
+                                           sp.record(to_=auction.value.creator,
                                                      amount=1,
-                                                     token_id=self.data.auctions[params].token.token_id)
+                                                     token_id=params.token_id)
                                        ])
             ]
-        self.transfer_token(self.data.auctions[params].token.address, _params)
-        del self.data.auctions[params]
-        sp.emit(sp.record(token=params.address,token_id=params.token_id),tag="AUCTION_CANCELED")
+        self.transfer_token(params.address, _params)
+        Events.order("AUCTION_CANCELED", sp.none, params, sp.sender, auction.value.current_price, 0)
     
     @sp.entry_point
     def bid(self, params):
         sp.set_type(params, t_list_key)
-        sp.verify(self.data.auctions.contains(params), "INVALID_AUCTION_ID")
-        sp.verify(sp.amount > self.data.auctions[params].current_price, "INSUFFICIENT_AMOUNT")
-        sp.verify(sp.now >= self.data.auctions[params].start_time, "AUCTION_NOT_STARTED")
-        sp.verify(sp.now <= self.data.auctions[params].end_time, "AUCTION_ENDED")
-        sp.if self.data.auctions[params].highest_bidder != self.data.auctions[params].creator:
-            sp.send(self.data.auctions[params].highest_bidder, self.data.auctions[params].current_price)
-        self.data.auctions[params].current_price = sp.amount
-        self.data.auctions[params].highest_bidder = sp.sender
-        sp.emit(sp.record(token=self.data.auctions[params].token.address,token_id=self.data.auctions[params].token.token_id,bid=sp.amount,bidder=sp.sender),tag="NEW_BID")
+        auction = sp.local("auction", self.data.auctions.get_opt(params).open_some("INVALID_AUCTION_ID"))
+        sp.verify(sp.amount > auction.value.current_price, "INSUFFICIENT_AMOUNT")
+        sp.verify(sp.now >= auction.value.start_time, "AUCTION_NOT_STARTED")
+        sp.verify(sp.now <= auction.value.end_time, "AUCTION_ENDED")
+        sp.if auction.value.highest_bidder.is_some():
+            Payout.refund(self.data, auction.value.highest_bidder.open_some(), auction.value.current_price)
+        auction.value.current_price = sp.amount
+        auction.value.highest_bidder = sp.some(sp.sender)
+        self.data.auctions[params] = auction.value
+        Events.bid("NEW_BID", params, sp.sender, sp.amount)
     
     @sp.entry_point
     def settle_auction(self, params):
         sp.set_type(params, t_list_key)
-        sp.verify(self.data.auctions.contains(params), "INVALID_AUCTION_ID")
+        auction = sp.local("auction", self.data.auctions.get_opt(params).open_some("INVALID_AUCTION_ID"))
+        sp.verify(sp.now > auction.value.end_time, "AUCTION_NOT_ENDED")
+        del self.data.auctions[params]
+        recipient = sp.local("recipient", auction.value.creator)
+        sp.if auction.value.highest_bidder.is_some():
+            recipient.value = auction.value.highest_bidder.open_some()
         _params = [
                 Batch_transfer.item(from_=sp.self_address,
                                        txs=[
-                                           sp.record(to_=self.data.auctions[params].highest_bidder,
+                                           sp.record(to_=recipient.value,
                                                      amount=1,
-                                                     token_id=self.data.auctions[params].token.token_id)
+                                                     token_id=params.token_id)
                                        ])
             ]
-        self.transfer_token(self.data.auctions[params].token.address, _params)
-        transfer_amount = sp.local("transfer_amount", self.data.auctions[params].current_price)
-        sp.send(self.data.fund_operator, sp.split_tokens(transfer_amount.value, self.data.platform_fees, 1000000))
-        transfer_amount.value = transfer_amount.value - sp.split_tokens(transfer_amount.value, self.data.platform_fees, 1000000)
-        sp.for txn in self.data.auctions[params].shares:
-            sp.send(txn.recipient, sp.split_tokens(transfer_amount.value, txn.amount, 1000000))
-            transfer_amount.value = transfer_amount.value - sp.split_tokens(transfer_amount.value, txn.amount, 1000000)
-        sp.send(sp.sender, transfer_amount.value)
-        del self.data.auctions[params]
-        sp.emit(sp.record(auction_id=params,tag="AUCTION_SETTLED"))
+        self.transfer_token(params.address, _params)
+        sp.if auction.value.highest_bidder.is_some():
+            payout = sp.local("sale_payout", Payout.pay_out(self.data, auction.value.current_price, params, auction.value.creator))
+            Stats.record_sale(self.data.collection_stats, params.address, auction.value.current_price, 1)
+            Events.sale("AUCTION_SETTLED", sp.none, params, auction.value.creator, recipient.value,
+                        auction.value.current_price, 1, 0, payout.value)
+        sp.else:
+            Events.order("AUCTION_UNSOLD", sp.none, params, auction.value.creator, auction.value.current_price, 0)
+
+    @sp.entry_point
+    def sweep_fees(self, amount):
+        sp.set_type(amount, sp.TOption(sp.TMutez))
+        sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
+        Payout.sweep_fees(self.data, amount)
+
+    @sp.entry_point
+    def toggle_accrue_payouts(self):
+        sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
+        self.data.accrue_payouts = ~self.data.accrue_payouts
+
+    @sp.entry_point
+    def withdraw(self):
+        sp.verify(self.data.balances.contains(sp.sender), "NO_BALANCE")
+        Payout.withdraw(self.data, sp.sender)
+
+    @sp.entry_point
+    def withdraw_for(self, recipients):
+        sp.set_type(recipients, sp.TList(sp.TAddress))
+        sp.for recipient in recipients:
+            Payout.withdraw(self.data, recipient)
 
     @sp.entry_point
     def toggle_pause(self):
         sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
         self.data.pause = ~self.data.pause
 
+    @sp.onchain_view()
+    def get_collection_stats(self, address):
+        """Get the sale statistics of an FA2 contract, all zero if nothing
+        from it has been sold yet."""
+        sp.set_type(address, sp.TAddress)
+        sp.result(self.data.collection_stats.get(address, Stats.empty()))
+
 sp.add_compilation_target("auction", Auction(
     mods=[sp.address("tz1XzzMGjiJWVLAsdsqSNjgu7SuPvVw7JjGM")],
     fund_operator=sp.address("tz1XzzMGjiJWVLAsdsqSNjgu7SuPvVw7JjGM")))
 
+sp.add_compilation_target("auction_lazy", Auction(
+    mods=[sp.address("tz1XzzMGjiJWVLAsdsqSNjgu7SuPvVw7JjGM")],
+    fund_operator=sp.address("tz1XzzMGjiJWVLAsdsqSNjgu7SuPvVw7JjGM"),
+    lazy_entry_points=True))
+
+@sp.add_test(name="Auction lazy entry points")
+def test():
+    sc = sp.test_scenario()
+    sc.h1("Auction: eager vs lazy entry points")
+    sc.p("Compare the gas of the bid and collect calls below; only the entry point being called is loaded from a lazy contract.")
+    sc.table_of_contents()
+    admin = sp.test_account("Admin")
+    alice = sp.test_account("Alice")
+    elon = sp.test_account("Elon")
+    fund_operator = sp.test_account("FundOperator")
+
+    metadata = sp.map({"": sp.utils.bytes_of_string("https://example.com")})
+    fa2 = FA2_contract.FA2(config=FA2_contract.environment_config(), metadata=metadata, admin=admin.address)
+    sc += fa2
+
+    for index, lazy in enumerate([False, True]):
+        sc.h2("Lazy entry points" if lazy else "Eager entry points")
+        auc = Auction(mods = [admin.address], fund_operator = fund_operator.address, lazy_entry_points = lazy)
+        sc += auc
+        for token_id in [2 * index, 2 * index + 1]:
+            fa2.mint(address=alice.address,
+                     amount=1,
+                     metadata=metadata,
+                     royalties=[],
+                     token_id=token_id).run(sender=admin.address)
+            sc += fa2.update_operators([
+                        sp.variant("add_operator", sp.record(
+                            owner=alice.address,
+                            operator=auc.address,
+                            token_id=token_id))]).run(sender=alice.address)
+        auction_token = sp.record(address = fa2.address, token_id = sp.nat(2 * index))
+        sale_token = sp.record(address = fa2.address, token_id = sp.nat(2 * index + 1))
+        sc += auc.create_auction(sp.record(
+            creator = alice.address,
+            token = auction_token,
+            start_time = sp.timestamp(0),
+            end_time = sp.timestamp(10),
+            current_price = sp.tez(0)
+        )).run(sender = alice.address)
+        sc += auc.put_on_sale(sp.record(
+            creator = alice.address,
+            token = sale_token,
+            price = sp.tez(1)
+        )).run(sender = alice.address)
+        sc.h3("bid")
+        sc += auc.bid(auction_token).run(sender = elon.address, amount = sp.tez(1), now = sp.timestamp(1))
+        sc.h3("collect")
+        sc += auc.collect(sale_token).run(sender = elon.address, amount = sp.tez(1))
+        stats = auc.get_collection_stats(fa2.address)
+        sc.verify(stats.last_price == sp.tez(1))
+        sc.verify(stats.average_price == sp.tez(1))
+        sc.verify(stats.volume == sp.tez(1))
+        sc.verify(stats.sales == 1)
+
 @sp.add_test(name="Auction")
 def test():
     sc = sp.test_scenario()
@@ -316,120 +408,157 @@ def test():
     get_share = Share()
     
     sc.h1("Code")
+    metadata = sp.map({"": sp.utils.bytes_of_string("https://example.com")})
+    fa2 = FA2_contract.FA2(config=FA2_contract.environment_config(), metadata=metadata, admin=admin.address)
+    sc += fa2
     auc = Auction(mods = [admin.address], fund_operator = fund_operator.address)
     sc += auc
     sc.show([sp.record(contract_balance = auc.balance)])
     
+    fa2.mint(address=alice.address,
+             amount=1,
+             metadata=metadata,
+             royalties=[],
+             token_id=0).run(sender=admin.address)
+    fa2.mint(address=bob.address,
+             amount=1,
+             metadata=metadata,
+             royalties=[],
+             token_id=1).run(sender=admin.address)
+    sc += fa2.update_operators([
+                sp.variant("add_operator", sp.record(
+                    owner=alice.address,
+                    operator=auc.address,
+                    token_id=0))]).run(sender=alice.address)
+    sc += fa2.update_operators([
+                sp.variant("add_operator", sp.record(
+                    owner=bob.address,
+                    operator=auc.address,
+                    token_id=1))]).run(sender=bob.address)
+    auction_token = sp.record(address = fa2.address, token_id = sp.nat(0))
+    other_token = sp.record(address = fa2.address, token_id = sp.nat(1))
+    
     sc += auc.add_moderator(alice.address).run(sender = admin.address)
     sc += auc.remove_moderator(alice.address).run(sender = admin.address)
     sc.h1("Put on Sale")
     list_data = sp.record(
             creator = alice.address,
-            token = sp.record(
-                address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
-                token_id = sp.nat(0)
-                ),
-            price = sp.tez(1),
-            shares = [
-                sp.record(
-                    amount=2,
-                    recipient=sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU")
-                )
-            ]
+            token = auction_token,
+            price = sp.tez(1)
         )
     sc += auc.put_on_sale(list_data).run(sender = alice.address)
     
     sc.h1("Cancel Sale")
-    sc += auc.cancel_sale(sp.record(
-                address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
-                token_id = sp.nat(0)
-                )).run(sender = alice.address)
+    sc += auc.cancel_sale(auction_token).run(sender = bob.address, valid = False)
+    sc += auc.cancel_sale(auction_token).run(sender = alice.address)
+    sc.verify(fa2.data.ledger[fa2.ledger_key.make(alice.address, 0)].balance == 1)
 
     sc.h1("Create Auction")
     auc_data = sp.record(
             creator = alice.address,
-            token = sp.record(
-                address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
-                token_id = sp.nat(0)
-                ),
+            token = auction_token,
             start_time = sp.timestamp(0),
             end_time = sp.timestamp(10),
-            current_price = sp.tez(0),
-            highest_bidder = alice.address,
-            shares = [
-                sp.record(
-                    amount=20000,
-                    recipient=sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU")
-                )
-            ]
+            current_price = sp.tez(0)
         )
     sc += auc.create_auction(auc_data).run(sender = alice.address)
     auc_data = sp.record(
             creator = bob.address,
-            token = sp.record(
-                address = sp.address("KT1Tezooo1zzSmartPyzzDYNAMiCzzpLu4LU"),
-                token_id = sp.nat(1)
-                ),
+            token = other_token,
             start_time = sp.timestamp(0),
             end_time = sp.timestamp(10),
-            current_price = sp.tez(0),
-            highest_bidder = bob.address,
-            shares = [
-                sp.record(
-                    amount=20000,
-                    recipient=sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU")
-                )
-            ]
+            current_price = sp.tez(0)
         )
     sc += auc.create_auction(auc_data).run(sender = bob.address)
     sc.show([sp.record(contract_balance = auc.balance)])
     
     sc.h1("Bid")
-    # sc += auc.bid(sp.record(
-    #             address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
-    #             token_id = sp.nat(0)
-    #             )).run(sender = elon.address, amount=sp.tez(1))
-    # sc.show([sp.record(contract_balance = auc.balance)])
-    # sc += auc.bid(sp.record(
-    #             address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
-    #             token_id = sp.nat(0)
-    #             )).run(sender = elon.address, amount=sp.tez(1))
-    # sc.show([sp.record(contract_balance = auc.balance)])
-    # sc += auc.bid(sp.record(
-    #             address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
-    #             token_id = sp.nat(0)
-    #             )).run(sender = bob.address, amount=sp.tez(2))
-    # sc.show([sp.record(contract_balance = auc.balance)])
-    # sc += auc.bid(sp.record(
-    #             address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
-    #             token_id = sp.nat(0)
-    #             )).run(sender = mark.address, amount=sp.tez(3))
-    # sc.show([sp.record(contract_balance = auc.balance)])
-    # sc += auc.bid(sp.record(
-    #             address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
-    #             token_id = sp.nat(0)
-    #             )).run(sender = elon.address, amount=sp.tez(3), valid=False)
-    # sc.show([sp.record(contract_balance = auc.balance)])
-    # sc += auc.bid(sp.record(
-    #             address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
-    #             token_id = sp.nat(0)
-    #             )).run(sender = admin.address, amount=sp.tez(5))
-    # sc.show([sp.record(contract_balance = auc.balance)])
+    sc += auc.bid(auction_token).run(sender = elon.address, amount = sp.tez(1), now = sp.timestamp(1))
+    sc.show([sp.record(contract_balance = auc.balance)])
+    sc += auc.bid(auction_token).run(sender = elon.address, amount = sp.tez(1), now = sp.timestamp(2), valid = False)
+    sc += auc.bid(auction_token).run(sender = bob.address, amount = sp.tez(2), now = sp.timestamp(3))
+    sc.show([sp.record(contract_balance = auc.balance)])
+    sc += auc.bid(auction_token).run(sender = mark.address, amount = sp.tez(3), now = sp.timestamp(4))
+    sc.show([sp.record(contract_balance = auc.balance)])
+    sc += auc.bid(auction_token).run(sender = elon.address, amount = sp.tez(3), now = sp.timestamp(5), valid = False)
+    sc += auc.bid(auction_token).run(sender = admin.address, amount = sp.tez(5), now = sp.timestamp(6))
+    sc.show([sp.record(contract_balance = auc.balance)])
+    sc += auc.bid(auction_token).run(sender = elon.address, amount = sp.tez(6), now = sp.timestamp(11), valid = False)
+    sc.verify(auc.data.auctions[auction_token].highest_bidder == sp.some(admin.address))
+    sc.verify(auc.balance == sp.tez(5))
     
-    # sc.h1("Cancel Auction")
-    # sc += auc.cancel_auction(sp.record(
-    #             address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
-    #             token_id = sp.nat(1)
-    #             )).run(sender = bob.address)
-    # sc.show([sp.record(contract_balance = auc.balance)])
+    sc.h1("Cancel Auction")
+    sc += auc.cancel_auction(other_token).run(sender = alice.address, valid = False)
+    sc += auc.cancel_auction(other_token).run(sender = bob.address)
+    sc.verify(~ auc.data.auctions.contains(other_token))
+    sc.verify(fa2.data.ledger[fa2.ledger_key.make(bob.address, 1)].balance == 1)
+    sc.show([sp.record(contract_balance = auc.balance)])
     
-    # sc.h1("Settle Auction")
-    # sc += auc.settle_auction(sp.record(
-    #             address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
-    #             token_id = sp.nat(0)
-    #             )).run(sender = alice.address)
-    # sc.show([sp.record(contract_balance = auc.balance)])
+    sc.h1("Settle Auction")
+    sc += auc.settle_auction(auction_token).run(sender = alice.address, now = sp.timestamp(10), valid = False)
+    sc += auc.settle_auction(auction_token).run(sender = alice.address, now = sp.timestamp(11))
+    sc.verify(~ auc.data.auctions.contains(auction_token))
+    sc.verify(fa2.data.ledger[fa2.ledger_key.make(admin.address, 0)].balance == 1)
+    stats = auc.get_collection_stats(fa2.address)
+    sc.verify(stats.last_price == sp.tez(5))
+    sc.verify(stats.average_price == sp.tez(5))
+    sc.verify(stats.volume == sp.tez(5))
+    sc.verify(stats.sales == 1)
+    sc.show([sp.record(contract_balance = auc.balance)])
     
+    sc.h1("Storage layout")
+    sc.p("Packed bytes of one listing and of one auction before its first bid, with the previous value types for comparison.")
+    token = sp.record(address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"), token_id = sp.nat(0))
+    sc.show(sp.record(
+        list_before = sp.len(sp.pack(sp.record(creator = alice.address, token = token, price = sp.tez(1)))),
+        list_after = sp.len(sp.pack(sp.set_type_expr(
+            sp.record(creator = alice.address, price = sp.tez(1)),
+            ListData().type_value))),
+        auction_before = sp.len(sp.pack(sp.record(creator = alice.address, token = token,
+            start_time = sp.timestamp(1700000000), end_time = sp.timestamp(1700086400),
+            current_price = sp.tez(1), highest_bidder = alice.address))),
+        auction_after = sp.len(sp.pack(sp.set_type_expr(
+            sp.record(creator = alice.address, start_time = sp.timestamp(1700000000),
+                      end_time = sp.timestamp(1700086400), current_price = sp.tez(1),
+                      highest_bidder = sp.none),
+            AuctionData().type_value)))
+    ))
+
+    sc.h1("Accrued payouts")
+    sc += auc.toggle_accrue_payouts().run(sender = admin.address)
+    sc.p("Outbid and cancellation refunds are credited instead of sent.")
+    sc += auc.create_auction(sp.record(
+            creator = bob.address,
+            token = other_token,
+            start_time = sp.timestamp(0),
+            end_time = sp.timestamp(100),
+            current_price = sp.tez(0)
+        )).run(sender = bob.address, now = sp.timestamp(20))
+    sc += auc.bid(other_token).run(sender = elon.address, amount = sp.tez(1), now = sp.timestamp(21))
+    sc += auc.bid(other_token).run(sender = mark.address, amount = sp.tez(2), now = sp.timestamp(22))
+    sc.verify(auc.data.balances[elon.address] == sp.tez(1))
+    sc += auc.cancel_auction(other_token).run(sender = bob.address, now = sp.timestamp(23))
+    sc.verify(auc.data.balances[mark.address] == sp.tez(2))
+    sc += auc.withdraw_for([elon.address, mark.address]).run(sender = bob.address)
+    sc.verify(~ auc.data.balances.contains(elon.address))
+    sc += auc.withdraw().run(sender = alice.address, valid = False)
+    sc += auc.withdraw_for([alice.address, fund_operator.address]).run(sender = bob.address)
+    sc += auc.sweep_fees(sp.none).run(sender = admin.address)
+
+    sc.h1("Collection stats")
+    sc.p("After the 5 tez auction, a 3 tez sale moves the average by a tenth of the difference.")
+    sc += auc.put_on_sale(sp.record(
+            creator = bob.address,
+            token = other_token,
+            price = sp.tez(3)
+        )).run(sender = bob.address)
+    sc += auc.collect(other_token).run(sender = elon.address, amount = sp.tez(3))
+    stats = auc.get_collection_stats(fa2.address)
+    sc.verify(stats.last_price == sp.tez(3))
+    sc.verify(stats.average_price == sp.mutez(4800000))
+    sc.verify(stats.volume == sp.tez(8))
+    sc.verify(stats.sales == 2)
+
     sc.h1("toggle_pause")
     sc += auc.toggle_pause().run(sender = admin.address)
     sc += auc.update_platform_fees(1200).run(sender = admin.address)
\ No newline at end of file
@@ -13,7 +13,7 @@ def global_parameter(env_var, default):
     except:
         return default
 
-def environment_config():
+def environment_config(consecutive_token_ids = True):
     return FA2_contract.FA2_config(
         debug_mode=global_parameter("debug_mode", False),
         single_asset=global_parameter("single_asset", False),
@@ -22,7 +22,7 @@ def environment_config():
         readable=global_parameter("readable", True),
         force_layouts=global_parameter("force_layouts", True),
         support_operator=global_parameter("support_operator", True),
-        assume_consecutive_token_ids=global_parameter(
+        assume_consecutive_token_ids=consecutive_token_ids and global_parameter(
             "assume_consecutive_token_ids", True),
         store_total_supply=global_parameter("store_total_supply", False),
         lazy_entry_points=global_parameter("lazy_entry_points", False),
@@ -48,12 +48,51 @@ class Batch_transfer:
         v = sp.record(from_=from_, txs=txs)
         return sp.set_type_expr(v, self.get_transfer_type())
 
+# A token the creator has signed for but not minted yet. The factory, as
+# the FA2 admin, mints it straight to the first buyer and pays the creator.
+# The creator withdraws a voucher by cancelling its nonce, which leaves the
+# token id free for a new voucher.
+class Mint_voucher:
+    def __init__(self):
+        self.type_value = sp.TRecord(
+            public_key = sp.TKey,
+            contract = sp.TAddress,
+            token_id = sp.TNat,
+            amount = sp.TNat,
+            metadata = sp.TMap(sp.TString, sp.TBytes),
+            royalties = sp.TList(FA2_contract.Royalty_share.get_type()),
+            price = sp.TMutez,
+            expiry_time = sp.TOption(sp.TTimestamp),
+            nonce = sp.TNat
+        )
+
+    def pack(self, factory, voucher):
+        return sp.pack(sp.record(
+            factory = factory,
+            voucher = sp.set_type_expr(voucher, self.type_value)
+        ))
+
 class Contract(sp.Contract):
     def __init__(self):
         self.init(
             contracts=sp.big_map(tkey=sp.TAddress, tvalue=sp.TSet(sp.TAddress)),
+            lazy_collections=sp.big_map(tkey=sp.TAddress, tvalue=sp.TUnit),
+            lazy_minted=sp.big_map(tkey=sp.TPair(sp.TAddress, sp.TNat), tvalue=sp.TUnit),
+            cancelled_vouchers=sp.big_map(tkey=sp.TPair(sp.TAddress, sp.TNat), tvalue=sp.TUnit),
         )
 
+    def mint(self, contract, address, amount, token_id, metadata, royalties):
+        contractParams = sp.contract(sp.TRecord(address = sp.TAddress, amount = sp.TNat, metadata = sp.TMap(sp.TString, sp.TBytes), royalties = sp.TList(FA2_contract.Royalty_share.get_type()), token_id = sp.TNat), contract, entry_point="mint").open_some()
+        dataToBeSent = sp.record(address = address, amount = amount, metadata = metadata, royalties = royalties, token_id = token_id)
+        sp.transfer(dataToBeSent,sp.mutez(0),contractParams)
+
+    def use_voucher(self, contract, token_id):
+        # A voucher is spent by its sale or its cancellation, whichever
+        # comes first, so it can never mint twice even for fungible tokens.
+        key = sp.local("voucher_key", sp.pair(contract, token_id))
+        sp.verify(~ self.data.lazy_minted.contains(key.value), "VOUCHER_USED")
+        self.data.lazy_minted[key.value] = sp.unit
+
     # Define the entrypoint to deploy the FA2 contract
     @sp.entry_point
     def deploy_fa2(self, metadata):
@@ -69,18 +108,67 @@ class Contract(sp.Contract):
         sp.else:
             self.data.contracts[sp.sender] = sp.set([fa2_contract])
         sp.emit(sp.record(event="CONTRACT_DEPLOYED",deployed_by=sp.sender,contract_address=fa2_contract),tag="CONTRACT_DEPLOYED")
+
+    # Lazy-mint collections do not assume consecutive token ids, so vouchers
+    # can be redeemed or cancelled in any order.
+    @sp.entry_point
+    def deploy_lazy_fa2(self, metadata):
+        fa2_contract = sp.create_contract(
+            contract = FA2_contract.FA2(config=environment_config(consecutive_token_ids = False),
+                              metadata=metadata,
+                              admin=sp.self_address)
+        )
+        sp.if self.data.contracts.contains(sp.sender):
+            self.data.contracts[sp.sender].add(fa2_contract)
+        sp.else:
+            self.data.contracts[sp.sender] = sp.set([fa2_contract])
+        self.data.lazy_collections[fa2_contract] = sp.unit
+        sp.emit(sp.record(event="CONTRACT_DEPLOYED",deployed_by=sp.sender,contract_address=fa2_contract),tag="CONTRACT_DEPLOYED")
     
     @sp.entry_point
-    def mint_token(self, contract, amount, token_id, metadata):
+    def mint_token(self, contract, amount, token_id, metadata, royalties):
         sp.set_type(contract, sp.TAddress)
         sp.set_type(amount, sp.TNat)
         sp.set_type(token_id, sp.TNat)
         sp.set_type(metadata, sp.TMap(sp.TString, sp.TBytes))
+        sp.set_type(royalties, sp.TList(FA2_contract.Royalty_share.get_type()))
         sp.verify(self.data.contracts[sp.sender].contains(contract), "INVALID_CONTRACT")
-        contractParams = sp.contract(sp.TRecord(address = sp.TAddress, amount = sp.TNat, metadata = sp.TMap(sp.TString, sp.TBytes), token_id = sp.TNat), contract, entry_point="mint").open_some()
-        dataToBeSent = sp.record(address = sp.sender, amount = amount, metadata = metadata, token_id = token_id)
-        sp.transfer(dataToBeSent,sp.mutez(0),contractParams)
+        self.mint(contract, sp.sender, amount, token_id, metadata, royalties)
         sp.emit(sp.record(event="TOKEN_MINTED",minted_by=sp.sender,amount=amount),tag="TOKEN_MINTED")
+
+    @sp.entry_point
+    def buy_lazy_mint(self, voucher, signature):
+        sp.set_type(voucher, Mint_voucher().type_value)
+        sp.set_type(signature, sp.TSignature)
+        sp.verify(sp.check_signature(voucher.public_key, signature, Mint_voucher().pack(sp.self_address, voucher)), "INVALID_SIGNATURE")
+        sp.if voucher.expiry_time.is_some():
+            sp.verify(sp.now < voucher.expiry_time.open_some(), "EXPIRED")
+        sp.verify(sp.amount == voucher.price, "INVALID_AMOUNT")
+        creator = sp.local("creator", sp.to_address(sp.implicit_account(sp.hash_key(voucher.public_key))))
+        sp.verify(self.data.contracts.get(creator.value, sp.set(t = sp.TAddress)).contains(voucher.contract), "INVALID_CONTRACT")
+        sp.verify(self.data.lazy_collections.contains(voucher.contract), "NOT_LAZY_COLLECTION")
+        sp.verify(~ self.data.cancelled_vouchers.contains(sp.pair(creator.value, voucher.nonce)), "VOUCHER_CANCELLED")
+        self.use_voucher(voucher.contract, voucher.token_id)
+        self.mint(voucher.contract, sp.sender, voucher.amount, voucher.token_id, voucher.metadata, voucher.royalties)
+        sp.if sp.amount > sp.mutez(0):
+            sp.send(creator.value, sp.amount)
+        sp.emit(sp.record(event="TOKEN_LAZY_MINTED",creator=creator.value,bought_by=sp.sender,contract=voucher.contract,token_id=voucher.token_id,amount=voucher.amount,price=voucher.price),tag="TOKEN_LAZY_MINTED")
+
+    @sp.entry_point
+    def cancel_lazy_mint(self, contract, token_id):
+        sp.set_type(contract, sp.TAddress)
+        sp.set_type(token_id, sp.TNat)
+        sp.verify(self.data.contracts[sp.sender].contains(contract), "INVALID_CONTRACT")
+        sp.verify(self.data.lazy_collections.contains(contract), "NOT_LAZY_COLLECTION")
+        self.use_voucher(contract, token_id)
+        sp.emit(sp.record(event="LAZY_MINT_CANCELLED",cancelled_by=sp.sender,contract=contract,token_id=token_id),tag="LAZY_MINT_CANCELLED")
+
+    @sp.entry_point
+    def cancel_voucher(self, nonce):
+        sp.set_type(nonce, sp.TNat)
+        sp.verify(~ self.data.cancelled_vouchers.contains(sp.pair(sp.sender, nonce)), "VOUCHER_CANCELLED")
+        self.data.cancelled_vouchers[sp.pair(sp.sender, nonce)] = sp.unit
+        sp.emit(sp.record(event="VOUCHER_CANCELLED",cancelled_by=sp.sender,nonce=nonce),tag="VOUCHER_CANCELLED")
     
     @sp.entry_point
     def transfer_token(self, contract, params_):
@@ -164,7 +252,51 @@ def test():
     # sc += c.deploy_fa2(sp.utils.metadata_of_url("https://example2.com")).run(sender = elon.address)
     # sc += c.deploy_fa2(sp.utils.metadata_of_url("https://example3.com")).run(sender = mark.address)
     sc.h1("Minting tokens in FA2 Contracts")
-    sc += c.mint_token(contract = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"), amount = sp.nat(10), token_id = sp.nat(0), metadata = sp.map({"": sp.utils.bytes_of_string("https://ipfs.io/ipfs/bafyreias7kz2ryktu34afqwh56pltm32uxsecaxsootklwlsquw5gn3ptq/metadata.json/")})).run(sender = admin.address)
+    sc += c.mint_token(contract = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"), amount = sp.nat(10), token_id = sp.nat(0), metadata = sp.map({"": sp.utils.bytes_of_string("https://ipfs.io/ipfs/bafyreias7kz2ryktu34afqwh56pltm32uxsecaxsootklwlsquw5gn3ptq/metadata.json/")}), royalties = [sp.record(recipient = admin.address, amount = sp.nat(50000))]).run(sender = admin.address)
+    sc.h1("Lazy minting")
+    sc += c.deploy_lazy_fa2(sp.utils.metadata_of_url("https://example2.com")).run(sender = admin.address)
+    lazy_collection = sp.address("KT1Tezooo1zzSmartPyzzDYNAMiCzzpLu4LU")
+    metadata = sp.map({"": sp.utils.bytes_of_string("https://ipfs.io/ipfs/bafyreias7kz2ryktu34afqwh56pltm32uxsecaxsootklwlsquw5gn3ptq/metadata.json/")})
+    def make_voucher(creator, contract, token_id, price, nonce = 0):
+        voucher = sp.record(
+            public_key = creator.public_key,
+            contract = contract,
+            token_id = sp.nat(token_id),
+            amount = sp.nat(1),
+            metadata = metadata,
+            royalties = [sp.record(recipient = creator.address, amount = sp.nat(50000))],
+            price = price,
+            expiry_time = sp.none,
+            nonce = sp.nat(nonce)
+        )
+        return voucher, sp.make_signature(creator.secret_key, Mint_voucher().pack(c.address, voucher), message_format = "Raw")
+    voucher, signature = make_voucher(admin, lazy_collection, 5, sp.tez(3))
+    sc += c.buy_lazy_mint(voucher = voucher, signature = signature).run(sender = bob.address, amount = sp.tez(2), valid = False)
+    sc.p("Token 5 sells while tokens 0 to 4 are still unminted.")
+    sc += c.buy_lazy_mint(voucher = voucher, signature = signature).run(sender = bob.address, amount = sp.tez(3))
+    sc += c.buy_lazy_mint(voucher = voucher, signature = signature).run(sender = elon.address, amount = sp.tez(3), valid = False)
+    sc.p("Cancelling token 3 does not block later ids.")
+    sc += c.cancel_lazy_mint(contract = lazy_collection, token_id = sp.nat(3)).run(sender = admin.address)
+    voucher, signature = make_voucher(admin, lazy_collection, 3, sp.tez(1))
+    sc += c.buy_lazy_mint(voucher = voucher, signature = signature).run(sender = elon.address, amount = sp.tez(1), valid = False)
+    voucher, signature = make_voucher(admin, lazy_collection, 4, sp.tez(1))
+    sc += c.buy_lazy_mint(voucher = voucher, signature = signature).run(sender = elon.address, amount = sp.tez(1))
+    voucher, signature = make_voucher(admin, lazy_collection, 1, sp.tez(1))
+    sc += c.buy_lazy_mint(voucher = voucher, signature = signature).run(sender = elon.address, amount = sp.tez(1))
+    sc.p("Repricing token 6: the 1 tez voucher is cancelled by its nonce and the 2 tez one stays valid.")
+    cheap_voucher, cheap_signature = make_voucher(admin, lazy_collection, 6, sp.tez(1), nonce = 1)
+    voucher, signature = make_voucher(admin, lazy_collection, 6, sp.tez(2), nonce = 2)
+    sc += c.cancel_voucher(sp.nat(1)).run(sender = admin.address)
+    sc += c.cancel_voucher(sp.nat(1)).run(sender = admin.address, valid = False)
+    sc += c.buy_lazy_mint(voucher = cheap_voucher, signature = cheap_signature).run(sender = elon.address, amount = sp.tez(1), valid = False)
+    sc += c.buy_lazy_mint(voucher = voucher, signature = signature).run(sender = elon.address, amount = sp.tez(2))
+    sc.verify(c.data.lazy_minted.contains(sp.pair(lazy_collection, 6)))
+    sc.p("Vouchers need a lazy-mint collection deployed by their signer.")
+    voucher, signature = make_voucher(admin, sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"), 2, sp.tez(1))
+    sc += c.buy_lazy_mint(voucher = voucher, signature = signature).run(sender = elon.address, amount = sp.tez(1), valid = False)
+    voucher, signature = make_voucher(bob, lazy_collection, 2, sp.tez(1))
+    sc += c.buy_lazy_mint(voucher = voucher, signature = signature).run(sender = elon.address, amount = sp.tez(1), valid = False)
+
     sc.h1("Transfering Tokens in FA2 Contracts")
     sc += c.transfer_token(
             params_ = [
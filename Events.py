@@ -0,0 +1,209 @@
+import smartpy as sp
+
+# Typed, versioned events shared by the Marketplace and Auction contracts.
+#
+# Every order event carries the order id, its token, the unit price and the
+# editions still open after the call, and every sale also carries the
+# platform fee and the amount paid to each recipient, so the order books can
+# be followed from events alone. Auction orders are keyed by their token and
+# have no id. Batch creations emit a single range event instead of one event
+# per order. Collection and trait offers, fund movements and administrative
+# changes have their own payloads below. `version` is bumped whenever a
+# payload changes shape.
+
+version = sp.nat(1)
+
+t_token = sp.TRecord(
+    address = sp.TAddress,
+    token_id = sp.TNat
+)
+
+t_order = sp.TRecord(
+    version = sp.TNat,
+    id = sp.TOption(sp.TNat),
+    token = t_token,
+    creator = sp.TAddress,
+    price = sp.TMutez,
+    editions = sp.TNat
+)
+
+t_sale = sp.TRecord(
+    version = sp.TNat,
+    id = sp.TOption(sp.TNat),
+    token = t_token,
+    seller = sp.TAddress,
+    buyer = sp.TAddress,
+    price = sp.TMutez,
+    quantity = sp.TNat,
+    editions = sp.TNat,
+    fee = sp.TMutez,
+    payouts = sp.TMap(sp.TAddress, sp.TMutez)
+)
+
+t_bid = sp.TRecord(
+    version = sp.TNat,
+    token = t_token,
+    bidder = sp.TAddress,
+    price = sp.TMutez
+)
+
+t_batch = sp.TRecord(
+    version = sp.TNat,
+    creator = sp.TAddress,
+    first_id = sp.TNat,
+    count = sp.TNat
+)
+
+t_collection_offer = sp.TRecord(
+    version = sp.TNat,
+    id = sp.TNat,
+    creator = sp.TAddress,
+    address = sp.TAddress,
+    price = sp.TMutez,
+    editions = sp.TNat
+)
+
+t_trait_offer = sp.TRecord(
+    version = sp.TNat,
+    id = sp.TNat,
+    creator = sp.TAddress,
+    merkle_root = sp.TBytes,
+    price = sp.TMutez,
+    editions = sp.TNat
+)
+
+t_funds = sp.TRecord(
+    version = sp.TNat,
+    account = sp.TAddress,
+    amount = sp.TMutez
+)
+
+t_share_profile = sp.TRecord(
+    version = sp.TNat,
+    id = sp.TNat,
+    creator = sp.TAddress
+)
+
+t_nonce = sp.TRecord(
+    version = sp.TNat,
+    creator = sp.TAddress,
+    nonce = sp.TNat
+)
+
+t_sweep = sp.TRecord(
+    version = sp.TNat,
+    bucket = sp.TNat,
+    page = sp.TNat,
+    swept = sp.TNat
+)
+
+t_moderator = sp.TRecord(
+    version = sp.TNat,
+    moderator = sp.TAddress
+)
+
+t_platform_fees = sp.TRecord(
+    version = sp.TNat,
+    platform_fees = sp.TNat
+)
+
+def order(tag, id_, token, creator, price, editions):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        id = id_,
+        token = token,
+        creator = creator,
+        price = price,
+        editions = editions
+    ), t_order), tag = tag)
+
+def sale(tag, id_, token, seller, buyer, price, quantity, editions, payout):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        id = id_,
+        token = token,
+        seller = seller,
+        buyer = buyer,
+        price = price,
+        quantity = quantity,
+        editions = editions,
+        fee = payout.fee,
+        payouts = payout.payouts
+    ), t_sale), tag = tag)
+
+def bid(tag, token, bidder, price):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        token = token,
+        bidder = bidder,
+        price = price
+    ), t_bid), tag = tag)
+
+def batch(tag, creator, first_id, count):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        creator = creator,
+        first_id = first_id,
+        count = count
+    ), t_batch), tag = tag)
+
+def collection_offer(tag, id_, creator, address, price, editions):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        id = id_,
+        creator = creator,
+        address = address,
+        price = price,
+        editions = editions
+    ), t_collection_offer), tag = tag)
+
+def trait_offer(tag, id_, creator, merkle_root, price, editions):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        id = id_,
+        creator = creator,
+        merkle_root = merkle_root,
+        price = price,
+        editions = editions
+    ), t_trait_offer), tag = tag)
+
+def funds(tag, account, amount):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        account = account,
+        amount = amount
+    ), t_funds), tag = tag)
+
+def share_profile(tag, id_, creator):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        id = id_,
+        creator = creator
+    ), t_share_profile), tag = tag)
+
+def nonce(tag, creator, nonce):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        creator = creator,
+        nonce = nonce
+    ), t_nonce), tag = tag)
+
+def sweep(tag, bucket, page, swept):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        bucket = bucket,
+        page = page,
+        swept = swept
+    ), t_sweep), tag = tag)
+
+def moderator(tag, moderator):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        moderator = moderator
+    ), t_moderator), tag = tag)
+
+def platform_fees(tag, platform_fees):
+    sp.emit(sp.set_type_expr(sp.record(
+        version = version,
+        platform_fees = platform_fees
+    ), t_platform_fees), tag = tag)
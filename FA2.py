@@ -143,6 +143,7 @@ class Error_message:
     def not_admin(self): return self.make("NOT_ADMIN")
     def not_admin_or_operator(self): return self.make("NOT_ADMIN_OR_OPERATOR")
     def paused(self): return self.make("PAUSED")
+    def invalid_royalties(self): return self.make("INVALID_ROYALTIES")
 
 # The current type for a batched transfer in the specification is as
 # follows:
@@ -242,6 +243,18 @@ class Ledger_value:
     def make(balance):
         return sp.record(balance=balance)
 
+# Royalties are recorded per token at mint time, each share being expressed
+# in millionths of the sale price like the shares of the Marketplace and
+# Auction contracts which read them through the `get_royalties` view.
+
+
+class Royalty_share:
+    def get_type():
+        return sp.TRecord(recipient=sp.TAddress, amount=sp.TNat)
+
+    def make(recipient, amount):
+        return sp.record(recipient=recipient, amount=amount)
+
 # The link between operators and the addresses they operate is kept
 # in a *lazy set* of `(owner × operator × token-id)` values.
 ##
@@ -406,6 +419,8 @@ class FA2_core(sp.Contract):
             token_metadata=self.config.my_map(
                 tkey=sp.TNat, tvalue=self.token_meta_data.get_type()),
             operators=self.operator_set.make(),
+            royalties=self.config.my_map(
+                tkey=sp.TNat, tvalue=sp.TList(Royalty_share.get_type())),
             all_tokens=self.token_id_set.empty(),
             metadata=metadata,
             **extra_storage
@@ -580,6 +595,7 @@ class FA2_mint(FA2_core):
     @sp.entry_point
     def mint(self, params):
         sp.verify(self.is_administrator(sp.sender), message = self.error_message.not_admin())
+        sp.set_type(params.royalties, sp.TList(Royalty_share.get_type()))
         # We don't check for pauseness because we're the admin.
         if self.config.single_asset:
             sp.verify(params.token_id == 0,
@@ -602,6 +618,13 @@ class FA2_mint(FA2_core):
                 token_id=params.token_id,
                 token_info=params.metadata
             )
+            sp.if sp.len(params.royalties) > 0:
+                total_royalties = sp.local("total_royalties", sp.nat(0))
+                sp.for share in params.royalties:
+                    total_royalties.value += share.amount
+                sp.verify(total_royalties.value < 1000000,
+                          message=self.error_message.invalid_royalties())
+                self.data.royalties[params.token_id] = params.royalties
         if self.config.store_total_supply:
             self.data.total_supply[params.token_id] = params.amount + \
                 self.data.total_supply.get(params.token_id, default_value=0)
@@ -661,6 +684,31 @@ class FA2(FA2_change_metadata, FA2_token_metadata, FA2_mint, FA2_administrator,
             sp.set_type(tok, sp.TNat)
             sp.result("total-supply not supported")
 
+    @sp.onchain_view()
+    def get_royalties(self, tok):
+        """Get the royalty shares recorded for a token when it was minted."""
+        sp.set_type(tok, sp.TNat)
+        sp.result(self.data.royalties.get(tok, default_value=[]))
+
+    @sp.onchain_view()
+    def get_transferable(self, req):
+        """Get how many editions of a token `operator` can transfer out of
+        `owner`'s balance right now, zero if it is not an operator."""
+        sp.set_type(req, sp.TRecord(owner=sp.TAddress,
+                                    operator=sp.TAddress,
+                                    token_id=sp.TNat))
+        user = self.ledger_key.make(req.owner, req.token_id)
+        allowed = (req.owner == req.operator)
+        if self.config.support_operator:
+            allowed |= self.operator_set.is_member(self.data.operators,
+                                                   req.owner,
+                                                   req.operator,
+                                                   req.token_id)
+        transferable = sp.local("transferable", sp.nat(0))
+        sp.if allowed & ~self.is_paused() & self.data.ledger.contains(user):
+            transferable.value = self.data.ledger[user].balance
+        sp.result(transferable.value)
+
     @sp.offchain_view(pure=True)
     def is_operator(self, query):
         sp.set_type(query,
@@ -790,12 +838,15 @@ def add_test(config, is_default=True):
                 amount=50,
                 metadata=sp.map({"": sp.utils.bytes_of_string(
                     "https://ipfs.io/ipfs/bafyreias7kz2ryktu34afqwh56pltm32uxsecaxsootklwlsquw5gn3ptq/metadata.json/")}),
+                royalties=[],
                 token_id=0).run(sender=admin)
         # Mint a second time
         c1.mint(address=alice.address,
                 amount=50,
                 metadata=tok0_md,
+                royalties=[Royalty_share.make(alice.address, 50000)],
                 token_id=1).run(sender=admin)
+        scenario.verify(sp.len(c1.get_royalties(1)) == 1)
         scenario.h2("Transfers Alice -> Bob")
         c1.transfer(
             [
@@ -839,6 +890,7 @@ def add_test(config, is_default=True):
         c1.mint(address=bob.address,
                 amount=100,
                 metadata=tok1_md,
+                royalties=[],
                 token_id=2).run(sender=admin)
         tok2_md = FA2.make_metadata(
             name="The Token Number Three",
@@ -847,6 +899,7 @@ def add_test(config, is_default=True):
         c1.mint(address=bob.address,
                 amount=200,
                 metadata=tok2_md,
+                royalties=[],
                 token_id=3).run(sender=admin)
         # scenario.h3("Multi-token Transfer Bob -> Alice")
         # c1.transfer(
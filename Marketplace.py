@@ -2,6 +2,9 @@ import smartpy as sp
 
 # Import the modified FA2 contract
 FA2_contract = sp.io.import_script_from_url('file:./FA2.py')
+Payout = sp.io.import_script_from_url('file:./Payout.py')
+Events = sp.io.import_script_from_url('file:./Events.py')
+Stats = sp.io.import_script_from_url('file:./Stats.py')
 
 def global_parameter(env_var, default):
     try:
@@ -46,9 +49,7 @@ class Operator_param:
 
 class Share:
     def get_type(self):
-        t = sp.TRecord(
-            recipient=sp.TAddress,
-            amount=sp.TNat)
+        return Payout.t_share
 
     def make(self, recipient, amount):
         r = sp.record(
@@ -56,6 +57,26 @@ class Share:
             amount=amount)
         return sp.set_type_expr(r, self.get_type())
 
+t_token = sp.TRecord(
+    address = sp.TAddress,
+    token_id = sp.TNat
+)
+
+t_index = sp.TSet(sp.TPair(sp.TInt, sp.TNat))
+
+# Asks and offers with an expiry time are grouped in buckets of this many
+# seconds so that `sweep_expired` can find them. Each bucket is split in
+# pages of at most `expiry_page_size` ids, so that creating an order or
+# sweeping a page only ever loads one bounded set.
+expiry_bucket_size = 3600
+expiry_page_size = 50
+
+# The price indexes of a token hold at most this many asks and offers. Once
+# one is full an expired, undeliverable or unfunded order makes room first,
+# otherwise a new order has to beat the worst listed one, which is removed.
+# Escrow of a removed offer is credited to its creator's deposit.
+order_book_size = 20
+
 class Ask:
     def __init__(self):
         self.type_value = sp.TRecord(
@@ -67,8 +88,8 @@ class Ask:
             amount = sp.TMutez,
             editions = sp.TNat,
             expiry_time = sp.TOption(sp.TTimestamp),
-            shares = sp.TList(Share().get_type())
-        )
+            share_profile_id = sp.TNat
+        ).right_comb()
 
     def set_type(self): return sp.big_map(l = {}, tkey = sp.TNat, tvalue = self.type_value)
     
@@ -79,7 +100,7 @@ class Ask:
             amount = _params.amount,
             editions = _params.editions,
             expiry_time = _params.expiry_time,
-            shares = _params.shares
+            share_profile_id = _params.share_profile_id
         )
     
 class Offer:
@@ -91,9 +112,11 @@ class Offer:
                 token_id = sp.TNat
             ),
             amount = sp.TMutez,
+            quantity = sp.TNat,
+            use_deposit = sp.TBool,
             expiry_time = sp.TOption(sp.TTimestamp),
-            shares = sp.TList(Share().get_type())
-        )
+            share_profile_id = sp.TNat
+        ).right_comb()
     
     def set_type(self): return sp.big_map(l = {}, tkey = sp.TNat, tvalue = self.type_value)
 
@@ -102,10 +125,93 @@ class Offer:
             creator = _params.creator,
             token = _params.token,
             amount = _params.amount,
+            quantity = _params.quantity,
+            use_deposit = _params.use_deposit,
+            expiry_time = _params.expiry_time,
+            share_profile_id = _params.share_profile_id
+        )
+
+class Collection_offer:
+    def __init__(self):
+        self.type_value = sp.TRecord(
+            creator = sp.TAddress,
+            address = sp.TAddress,
+            amount = sp.TMutez,
+            quantity = sp.TNat,
+            expiry_time = sp.TOption(sp.TTimestamp),
+            share_profile_id = sp.TNat
+        )
+
+    def set_type(self): return sp.big_map(l = {}, tkey = sp.TNat, tvalue = self.type_value)
+
+    def set_value(self, _params):
+        return sp.record(
+            creator = _params.creator,
+            address = _params.address,
+            amount = _params.amount,
+            quantity = _params.quantity,
             expiry_time = _params.expiry_time,
-            shares = _params.shares
+            share_profile_id = _params.share_profile_id
+        )
+
+class Trait_offer:
+    def __init__(self):
+        self.type_value = sp.TRecord(
+            creator = sp.TAddress,
+            merkle_root = sp.TBytes,
+            amount = sp.TMutez,
+            quantity = sp.TNat,
+            expiry_time = sp.TOption(sp.TTimestamp),
+            share_profile_id = sp.TNat
+        )
+
+    def set_type(self): return sp.big_map(l = {}, tkey = sp.TNat, tvalue = self.type_value)
+
+    def set_value(self, _params):
+        return sp.record(
+            creator = _params.creator,
+            merkle_root = _params.merkle_root,
+            amount = _params.amount,
+            quantity = _params.quantity,
+            expiry_time = _params.expiry_time,
+            share_profile_id = _params.share_profile_id
+        )
+
+class Ask_batch:
+    def __init__(self):
+        self.type_value = sp.TRecord(
+            entries = sp.TList(sp.TRecord(
+                token = sp.TRecord(
+                    address = sp.TAddress,
+                    token_id = sp.TNat
+                ),
+                amount = sp.TMutez,
+                editions = sp.TNat,
+                expiry_time = sp.TOption(sp.TTimestamp)
+            )),
+            share_profile_id = sp.TNat
+        )
+
+class Signed_ask:
+    def __init__(self):
+        self.type_value = sp.TRecord(
+            public_key = sp.TKey,
+            token = sp.TRecord(
+                address = sp.TAddress,
+                token_id = sp.TNat
+            ),
+            amount = sp.TMutez,
+            expiry_time = sp.TOption(sp.TTimestamp),
+            share_profile_id = sp.TNat,
+            nonce = sp.TNat
         )
 
+    def pack(self, marketplace, order):
+        return sp.pack(sp.record(
+            marketplace = marketplace,
+            order = sp.set_type_expr(order, self.type_value)
+        ))
+
 class Batch_transfer:
     def get_transfer_type():
         tx_type = sp.TRecord(to_=sp.TAddress,
@@ -124,7 +230,9 @@ class Batch_transfer:
         return sp.set_type_expr(v, Batch_transfer.get_transfer_type())
     
 class Marketplace(sp.Contract):
-    def __init__(self, mods, fund_operator):
+    def __init__(self, mods, fund_operator, lazy_entry_points = False):
+        if lazy_entry_points:
+            self.add_flag("lazy-entry-points")
         self.init(
             # metadata = metadata,
             mods = sp.set(mods),
@@ -133,7 +241,25 @@ class Marketplace(sp.Contract):
             asks = Ask().set_type(),
             next_offer_id = sp.nat(0),
             offers = Offer().set_type(),
+            next_collection_offer_id = sp.nat(0),
+            collection_offers = Collection_offer().set_type(),
+            next_trait_offer_id = sp.nat(0),
+            trait_offers = Trait_offer().set_type(),
+            ask_index = sp.big_map(tkey = t_token, tvalue = t_index),
+            offer_index = sp.big_map(tkey = t_token, tvalue = t_index),
+            ask_expiries = sp.big_map(tkey = sp.TPair(sp.TNat, sp.TNat), tvalue = sp.TSet(sp.TNat)),
+            ask_expiry_pages = sp.big_map(tkey = sp.TNat, tvalue = sp.TNat),
+            offer_expiries = sp.big_map(tkey = sp.TPair(sp.TNat, sp.TNat), tvalue = sp.TSet(sp.TNat)),
+            offer_expiry_pages = sp.big_map(tkey = sp.TNat, tvalue = sp.TNat),
+            nonces = sp.big_map(tkey = sp.TPair(sp.TAddress, sp.TNat), tvalue = sp.TNat),
+            share_profiles = sp.big_map(l = {0: []}, tkey = sp.TNat, tvalue = sp.TList(Share().get_type())),
+            next_share_profile_id = sp.nat(1),
             platform_fees = sp.nat(20000),
+            accrued_fees = sp.mutez(0),
+            balances = sp.big_map(tkey = sp.TAddress, tvalue = sp.TMutez),
+            deposits = sp.big_map(tkey = sp.TAddress, tvalue = sp.TMutez),
+            accrue_payouts = sp.bool(False),
+            collection_stats = sp.big_map(tkey = sp.TAddress, tvalue = Stats.t_stats),
             pause = sp.bool(False)
         )
 
@@ -167,13 +293,320 @@ class Marketplace(sp.Contract):
     
     def is_paused(self):
         sp.verify(~self.data.pause, "CONTRACT_PAUSED")
+
+    def check_shares(self, shares):
+        total_shares = sp.local("total_shares", self.data.platform_fees)
+        sp.for txn in shares:
+            total_shares.value += txn.amount
+        sp.verify(total_shares.value < 1000000, "INVALID_SHARES")
+
+    def escrowed_amount(self, offer):
+        return sp.split_tokens(offer.amount, offer.quantity, 1)
+
+    def check_deposit(self, creator, amount):
+        # Deposit-backed offers move no tez until they are filled, the
+        # creator's balance only has to cover them when they are placed.
+        sp.verify(creator == sp.sender, "INVALID_CREATOR")
+        sp.verify(self.data.deposits.get(creator, sp.mutez(0)) >= amount, "INSUFFICIENT_BALANCE")
+
+    def debit_deposit(self, creator, amount):
+        balance = sp.local("deposit_balance", self.data.deposits.get(creator, sp.mutez(0)))
+        sp.verify(balance.value >= amount, "INSUFFICIENT_BALANCE")
+        sp.if balance.value == amount:
+            del self.data.deposits[creator]
+        sp.else:
+            self.data.deposits[creator] = balance.value - amount
+
+    def is_funded(self, offer, amount):
+        # Deposit-backed offers can outlive the deposit behind them, escrowed
+        # offers are always funded.
+        funded = sp.local("funded", True)
+        sp.if offer.use_deposit:
+            funded.value = self.data.deposits.get(offer.creator, sp.mutez(0)) >= amount
+        return funded.value
+
+    def refund_offer(self, offer, amount):
+        sp.if ~ offer.use_deposit:
+            sp.send(offer.creator, amount)
+
+    def is_expired(self, expiry_time):
+        expired = sp.local("expired", False)
+        sp.if expiry_time.is_some():
+            expired.value = sp.now >= expiry_time.open_some()
+        return expired.value
+
+    def check_expiry(self, expiry_time):
+        sp.verify(~ self.is_expired(expiry_time), "EXPIRED")
+
+    def expiry_bucket(self, expiry_time):
+        return sp.as_nat(expiry_time - sp.timestamp(0)) / expiry_bucket_size
+
+    def index_expiry(self, index, pages, item_id, expiry_time):
+        sp.if expiry_time.is_some():
+            bucket = sp.local("expiry_bucket", self.expiry_bucket(expiry_time.open_some()))
+            page = sp.local("expiry_page", pages.get(bucket.value, sp.nat(0)))
+            ids = sp.local("expiry_ids", index.get(sp.pair(bucket.value, page.value), sp.set(t = sp.TNat)))
+            sp.if sp.len(ids.value) >= expiry_page_size:
+                page.value += 1
+                pages[bucket.value] = page.value
+                ids.value = sp.set(t = sp.TNat)
+            ids.value.add(item_id)
+            index[sp.pair(bucket.value, page.value)] = ids.value
+
+    def sweep_bucket(self, name, index, bucket, page, max_items, swept, sweep_item):
+        # Ids of filled, retracted or updated entries are left in their
+        # page and dropped here; live entries stay until they expire. Both
+        # indexes are swept by one call, so locals are named after `name`.
+        key = sp.local(name + "_expiry_key", sp.pair(bucket, page))
+        sp.if index.contains(key.value):
+            entries = sp.local(name + "_expiry_entries", index[key.value])
+            ids = sp.local(name + "_expiry_ids", entries.value)
+            sp.for item_id in entries.value.elements():
+                sp.if swept.value < max_items:
+                    swept.value += 1
+                    sp.if sweep_item(item_id, bucket):
+                        ids.value.remove(item_id)
+            sp.if sp.len(ids.value) == 0:
+                del index[key.value]
+            sp.else:
+                index[key.value] = ids.value
+
+    def sweep_ask(self, ask_id, bucket):
+        drop = sp.local("drop_ask", True)
+        found = sp.local("found_ask", self.data.asks.get_opt(ask_id))
+        sp.if found.value.is_some():
+            ask = sp.local("ask", found.value.open_some())
+            sp.if self.is_expired(ask.value.expiry_time):
+                self.unindex_ask(ask_id, ask.value)
+                del self.data.asks[ask_id]
+                Events.order("ASK_EXPIRED", sp.some(ask_id), ask.value.token, ask.value.creator, ask.value.amount, 0)
+            sp.else:
+                sp.if ask.value.expiry_time.is_some():
+                    drop.value = self.expiry_bucket(ask.value.expiry_time.open_some()) != bucket
+        return drop.value
+
+    def sweep_offer(self, offer_id, bucket):
+        drop = sp.local("drop_offer", True)
+        found = sp.local("found_offer", self.data.offers.get_opt(offer_id))
+        sp.if found.value.is_some():
+            offer = sp.local("offer", found.value.open_some())
+            sp.if self.is_expired(offer.value.expiry_time):
+                self.refund_offer(offer.value, self.escrowed_amount(offer.value))
+                self.unindex_offer(offer_id, offer.value)
+                del self.data.offers[offer_id]
+                Events.order("OFFER_EXPIRED", sp.some(offer_id), offer.value.token, offer.value.creator, offer.value.amount, 0)
+            sp.else:
+                sp.if offer.value.expiry_time.is_some():
+                    drop.value = self.expiry_bucket(offer.value.expiry_time.open_some()) != bucket
+        return drop.value
+
+    def check_share_profile(self, share_profile_id):
+        sp.verify(self.data.share_profiles.contains(share_profile_id), "INVALID_SHARE_PROFILE")
+
+    def transferable(self, token, owner):
+        # Editions of `token` this contract may move out of `owner`'s
+        # balance, read from the FA2 get_transferable view. Token contracts
+        # without the view cannot be listed.
+        return sp.view("get_transferable", token.address,
+                       sp.record(owner = owner, operator = sp.self_address, token_id = token.token_id),
+                       t = sp.TNat).open_some("INVALID_TOKEN")
+
+    def check_transferable(self, token, owner, editions):
+        sp.verify(self.transferable(token, owner) >= editions, "NOT_TRANSFERABLE")
+
+    def use_nonce(self, creator, nonce):
+        key = sp.local("nonce_key", sp.pair(creator, nonce >> 8))
+        bit = sp.local("nonce_bit", sp.nat(1) << (nonce & 255))
+        word = sp.local("nonce_word", self.data.nonces.get(key.value, sp.nat(0)))
+        sp.verify((word.value & bit.value) == 0, "NONCE_USED")
+        self.data.nonces[key.value] = word.value | bit.value
+
+    def pay_out(self, amount, token, share_profile_id, seller):
+        return Payout.pay_out(self.data, amount, token, seller, self.data.share_profiles[share_profile_id])
+
+    def index_add(self, index, token, key, is_stale = None, evict = None):
+        entries = sp.local("index_entries", index.get(token, sp.set(t = sp.TPair(sp.TInt, sp.TNat))))
+        if is_stale is not None:
+            sp.if sp.len(entries.value) >= order_book_size:
+                victim = sp.local("index_victim", sp.none)
+                worst = sp.local("index_worst", key)
+                sp.for entry in entries.value.elements():
+                    sp.if victim.value.is_none():
+                        sp.if is_stale(sp.snd(entry)):
+                            victim.value = sp.some(entry)
+                    worst.value = entry
+                sp.if victim.value.is_none():
+                    sp.verify(key < worst.value, "ORDER_BOOK_FULL")
+                    victim.value = sp.some(worst.value)
+                entries.value.remove(victim.value.open_some())
+                evict(sp.snd(victim.value.open_some()))
+        entries.value.add(key)
+        index[token] = entries.value
+
+    def index_remove(self, index, token, key):
+        entries = sp.local("index_remaining", index[token])
+        entries.value.remove(key)
+        sp.if sp.len(entries.value) == 0:
+            del index[token]
+        sp.else:
+            index[token] = entries.value
+
+    def offer_index_key(self, offer_id, amount):
+        # Offers are indexed by decreasing price then increasing id, so the
+        # first element of a token's set is its best offer.
+        return sp.pair(- sp.to_int(sp.utils.mutez_to_nat(amount)), offer_id)
+
+    def index_offer(self, offer_id, offer):
+        self.index_add(self.data.offer_index, offer.token, self.offer_index_key(offer_id, offer.amount),
+                       self.is_stale_offer, self.evict_offer)
+
+    def is_stale_offer(self, offer_id):
+        offer = sp.local("indexed_offer", self.data.offers[offer_id])
+        return self.is_expired(offer.value.expiry_time) | ~ self.is_funded(offer.value, offer.value.amount)
+
+    def evict_offer(self, offer_id):
+        offer = sp.local("evicted_offer", self.data.offers[offer_id])
+        sp.if ~ offer.value.use_deposit:
+            self.data.deposits[offer.value.creator] = (self.data.deposits.get(offer.value.creator, sp.mutez(0))
+                                                       + self.escrowed_amount(offer.value))
+            Events.funds("DEPOSITED", offer.value.creator, self.escrowed_amount(offer.value))
+        del self.data.offers[offer_id]
+        Events.order("OFFER_EVICTED", sp.some(offer_id), offer.value.token, offer.value.creator, offer.value.amount, 0)
+
+    def unindex_offer(self, offer_id, offer):
+        self.index_remove(self.data.offer_index, offer.token, self.offer_index_key(offer_id, offer.amount))
+
+    def ask_index_key(self, ask_id, amount):
+        # Asks are indexed by increasing price then increasing id, so the
+        # first element of a token's set is its floor.
+        return sp.pair(sp.to_int(sp.utils.mutez_to_nat(amount)), ask_id)
+
+    def index_ask(self, ask_id, ask):
+        self.index_add(self.data.ask_index, ask.token, self.ask_index_key(ask_id, ask.amount),
+                       self.is_stale_ask, self.evict_ask)
+
+    def is_stale_ask(self, ask_id):
+        ask = sp.local("indexed_ask", self.data.asks[ask_id])
+        stale = sp.local("stale", self.is_expired(ask.value.expiry_time))
+        sp.if ~ stale.value:
+            stale.value = self.transferable(ask.value.token, ask.value.creator) == 0
+        return stale.value
+
+    def evict_ask(self, ask_id):
+        ask = sp.local("evicted_ask", self.data.asks[ask_id])
+        del self.data.asks[ask_id]
+        Events.order("ASK_EVICTED", sp.some(ask_id), ask.value.token, ask.value.creator, ask.value.amount, 0)
+
+    def unindex_ask(self, ask_id, ask):
+        self.index_remove(self.data.ask_index, ask.token, self.ask_index_key(ask_id, ask.amount))
+
+    def check_fill_ask(self, ask, quantity):
+        self.check_expiry(ask.expiry_time)
+        sp.verify(quantity > 0, "INVALID_QUANTITY")
+        sp.verify(ask.editions >= quantity, "INSUFFICIENT_EDITIONS")
+
+    def fill_ask(self, ask_id, ask, quantity):
+        self.check_fill_ask(ask.value, quantity)
+        total_price = sp.local("total_price", sp.split_tokens(ask.value.amount, quantity, 1))
+        payout = sp.local("sale_payout", self.pay_out(total_price.value, ask.value.token, ask.value.share_profile_id, ask.value.creator))
+        Stats.record_sale(self.data.collection_stats, ask.value.token.address, ask.value.amount, quantity)
+        _params = [
+                Batch_transfer.item(from_=ask.value.creator,
+                                       txs=[
+                                           sp.record(to_=sp.sender,
+                                                     amount=quantity,
+                                                     token_id=ask.value.token.token_id)
+                                       ])
+            ]
+        self.transfer_token(ask.value.token.address, _params)
+        ask.value.editions = sp.as_nat(ask.value.editions - quantity)
+        sp.if ask.value.editions == 0:
+            self.unindex_ask(ask_id, ask.value)
+            del self.data.asks[ask_id]
+        sp.else:
+            self.data.asks[ask_id] = ask.value
+        Events.sale("ASK_FULFILLED", sp.some(ask_id), ask.value.token, ask.value.creator, sp.sender,
+                    ask.value.amount, quantity, ask.value.editions, payout.value)
+        return total_price.value
+
+    def fill_offer(self, offer_id, offer, quantity):
+        self.check_expiry(offer.value.expiry_time)
+        sp.verify(quantity > 0, "INVALID_QUANTITY")
+        sp.verify(offer.value.quantity >= quantity, "INSUFFICIENT_QUANTITY")
+        _params = [
+                Batch_transfer.item(from_=sp.sender,
+                                       txs=[
+                                           sp.record(to_=offer.value.creator,
+                                                     amount=quantity,
+                                                     token_id=offer.value.token.token_id)
+                                       ])
+            ]
+        self.transfer_token(offer.value.token.address, _params)
+        price = sp.local("price", sp.split_tokens(offer.value.amount, quantity, 1))
+        sp.if offer.value.use_deposit:
+            self.debit_deposit(offer.value.creator, price.value)
+        payout = sp.local("sale_payout", self.pay_out(price.value, offer.value.token, offer.value.share_profile_id, sp.sender))
+        Stats.record_sale(self.data.collection_stats, offer.value.token.address, offer.value.amount, quantity)
+        offer.value.quantity = sp.as_nat(offer.value.quantity - quantity)
+        sp.if offer.value.quantity == 0:
+            self.unindex_offer(offer_id, offer.value)
+            del self.data.offers[offer_id]
+        sp.else:
+            self.data.offers[offer_id] = offer.value
+        Events.sale("OFFER_FULFILLED", sp.some(offer_id), offer.value.token, sp.sender, offer.value.creator,
+                    offer.value.amount, quantity, offer.value.quantity, payout.value)
+
+    def check_unit_offer(self, params):
+        self.is_paused()
+        sp.verify(params.creator == sp.sender, "INVALID_CREATOR")
+        sp.verify(params.quantity > 0, "INVALID_QUANTITY")
+        sp.verify(sp.amount == self.escrowed_amount(params), "INVALID_AMOUNT")
+        self.check_share_profile(params.share_profile_id)
+
+    def fill_unit_offer(self, offers, offer_id, offer, token, tag):
+        self.check_expiry(offer.value.expiry_time)
+        _params = [
+                Batch_transfer.item(from_=sp.sender,
+                                       txs=[
+                                           sp.record(to_=offer.value.creator,
+                                                     amount=1,
+                                                     token_id=token.token_id)
+                                       ])
+            ]
+        self.transfer_token(token.address, _params)
+        payout = sp.local("sale_payout", self.pay_out(offer.value.amount, token, offer.value.share_profile_id, sp.sender))
+        Stats.record_sale(self.data.collection_stats, token.address, offer.value.amount, 1)
+        offer.value.quantity = sp.as_nat(offer.value.quantity - 1)
+        sp.if offer.value.quantity == 0:
+            del offers[offer_id]
+        sp.else:
+            offers[offer_id] = offer.value
+        Events.sale(tag, sp.some(offer_id), token, sp.sender, offer.value.creator,
+                    offer.value.amount, 1, offer.value.quantity, payout.value)
+
+    def retract_unit_offer(self, offers, offer_id):
+        self.is_paused()
+        offer = sp.local("offer", offers.get_opt(offer_id).open_some("INVALID_OFFER_ID"))
+        sp.verify(offer.value.creator == sp.sender, "INVALID_CREATOR")
+        sp.send(sp.sender, self.escrowed_amount(offer.value))
+        del offers[offer_id]
+        return offer
+
+    def merkle_root(self, leaf, proof):
+        node = sp.local("merkle_node", leaf)
+        sp.for sibling in proof:
+            sp.if node.value < sibling:
+                node.value = sp.blake2b(sp.concat([node.value, sibling]))
+            sp.else:
+                node.value = sp.blake2b(sp.concat([sibling, node.value]))
+        return node.value
     
     @sp.entry_point
     def add_moderator(self, _moderator):
         sp.set_type(_moderator, sp.TAddress)
         sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
         self.data.mods.add(_moderator)
-        sp.emit(sp.record(moderator=_moderator),tag="MODERATOR_ADDED")
+        Events.moderator("MODERATOR_ADDED", _moderator)
         
     @sp.entry_point
     def remove_moderator(self, _moderator):
@@ -181,7 +614,7 @@ class Marketplace(sp.Contract):
         sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
         sp.verify(self.data.mods.contains(_moderator), "ADDRESS_NAT_MODERATOR")
         self.data.mods.remove(_moderator)
-        sp.emit(sp.record(moderator=_moderator),tag="MODERATOR_REMOVED")
+        Events.moderator("MODERATOR_REMOVED", _moderator)
     
     @sp.entry_point
     def update_platform_fees(self, platform_fees):
@@ -189,109 +622,649 @@ class Marketplace(sp.Contract):
         sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
         sp.verify(platform_fees < 1000000, "INVALID_SHARES")
         self.data.platform_fees = platform_fees
-        sp.emit(sp.record(platform_fees=platform_fees),tag="UPDATE_PLATFORM_FEES")
+        Events.platform_fees("UPDATE_PLATFORM_FEES", platform_fees)
         
+    @sp.entry_point
+    def register_share_profile(self, shares):
+        sp.set_type(shares, sp.TList(Share().get_type()))
+        self.check_shares(shares)
+        self.data.share_profiles[self.data.next_share_profile_id] = shares
+        Events.share_profile("SHARE_PROFILE_REGISTERED", self.data.next_share_profile_id, sp.sender)
+        self.data.next_share_profile_id += 1
+
     @sp.entry_point
     def offer(self, params):
         sp.set_type(params, Offer().type_value)
         self.is_paused()
-        sp.verify(sp.amount == params.amount, "INVALID_AMOUNT")
-        total_shares = sp.local("total_shares", self.data.platform_fees)
-        sp.for txn in params.shares:
-            total_shares.value += txn.amount
-        sp.verify(total_shares.value < 1000000, "INVALID_SHARES")
+        sp.verify(params.quantity > 0, "INVALID_QUANTITY")
+        sp.if params.use_deposit:
+            sp.verify(sp.amount == sp.mutez(0), "INVALID_AMOUNT")
+            self.check_deposit(params.creator, self.escrowed_amount(params))
+        sp.else:
+            sp.verify(sp.amount == self.escrowed_amount(params), "INVALID_AMOUNT")
+        self.check_share_profile(params.share_profile_id)
         self.data.offers[self.data.next_offer_id] = Offer().set_value(params)
+        self.index_offer(self.data.next_offer_id, params)
+        self.index_expiry(self.data.offer_expiries, self.data.offer_expiry_pages, self.data.next_offer_id, params.expiry_time)
+        Events.order("OFFER_CREATED", sp.some(self.data.next_offer_id), params.token, params.creator, params.amount, params.quantity)
         self.data.next_offer_id += 1
-        sp.emit(sp.record(creator=params.creator,token=params.token),tag="OFFER_CREATED")
 
     @sp.entry_point
-    def fulfill_offer(self, offer_id):
+    def offer_batch(self, params):
+        sp.set_type(params, sp.TList(Offer().type_value))
+        self.is_paused()
+        total_amount = sp.local("total_amount", sp.mutez(0))
+        deposit_amount = sp.local("deposit_amount", sp.mutez(0))
+        first_offer_id = sp.local("first_offer_id", self.data.next_offer_id)
+        next_offer_id = sp.local("next_offer_id", self.data.next_offer_id)
+        sp.for offer in params:
+            sp.verify(offer.creator == sp.sender, "INVALID_CREATOR")
+            sp.verify(offer.quantity > 0, "INVALID_QUANTITY")
+            self.check_share_profile(offer.share_profile_id)
+            sp.if offer.use_deposit:
+                deposit_amount.value += self.escrowed_amount(offer)
+            sp.else:
+                total_amount.value += self.escrowed_amount(offer)
+            self.data.offers[next_offer_id.value] = Offer().set_value(offer)
+            self.index_offer(next_offer_id.value, offer)
+            self.index_expiry(self.data.offer_expiries, self.data.offer_expiry_pages, next_offer_id.value, offer.expiry_time)
+            next_offer_id.value += 1
+        sp.verify(sp.amount == total_amount.value, "INVALID_AMOUNT")
+        sp.if deposit_amount.value > sp.mutez(0):
+            self.check_deposit(sp.sender, deposit_amount.value)
+        self.data.next_offer_id = next_offer_id.value
+        Events.batch("OFFERS_CREATED", sp.sender, first_offer_id.value, sp.as_nat(next_offer_id.value - first_offer_id.value))
+
+    @sp.entry_point
+    def fulfill_offer(self, offer_id, quantity):
         sp.set_type(offer_id, sp.TNat)
+        sp.set_type(quantity, sp.TNat)
         self.is_paused()
-        sp.verify(self.data.offers.contains(offer_id), "INVALID_OFFER_ID")
-        _params = [
-                Batch_transfer.item(from_=sp.sender,
-                                       txs=[
-                                           sp.record(to_=self.data.offers[offer_id].creator,
-                                                     amount=1,
-                                                     token_id=self.data.offers[offer_id].token.token_id)
-                                       ])
-            ]
-        self.transfer_token(self.data.offers[offer_id].token.address, _params)
-        transfer_amount = sp.local("transfer_amount", self.data.offers[offer_id].amount)
-        sp.send(self.data.fund_operator, sp.split_tokens(transfer_amount.value, self.data.platform_fees, 1000000))
-        transfer_amount.value = transfer_amount.value - sp.split_tokens(transfer_amount.value, self.data.platform_fees, 1000000)
-        sp.for txn in self.data.offers[offer_id].shares:
-            sp.send(txn.recipient, sp.split_tokens(transfer_amount.value, txn.amount, 1000000))
-            transfer_amount.value = transfer_amount.value - sp.split_tokens(transfer_amount.value, txn.amount, 1000000)
-        sp.send(sp.sender, transfer_amount.value)
-        del self.data.offers[offer_id]
-        sp.emit(sp.record(offer_id=offer_id),tag="OFFER_FULFILLED")
+        offer = sp.local("offer", self.data.offers.get_opt(offer_id).open_some("INVALID_OFFER_ID"))
+        self.fill_offer(offer_id, offer, quantity)
+
+    @sp.entry_point
+    def accept_best_offer(self, token, min_amount):
+        sp.set_type(token, t_token)
+        sp.set_type(min_amount, sp.TMutez)
+        self.is_paused()
+        best = sp.local("best_offer", sp.none)
+        sp.for entry in self.data.offer_index.get_opt(token).open_some("NO_OFFER").elements():
+            sp.if best.value.is_none():
+                candidate = sp.local("candidate", self.data.offers[sp.snd(entry)])
+                sp.if ~ self.is_expired(candidate.value.expiry_time):
+                    sp.if self.is_funded(candidate.value, candidate.value.amount):
+                        best.value = sp.some(sp.pair(sp.snd(entry), candidate.value))
+        sp.verify(best.value.is_some(), "NO_OFFER")
+        offer = sp.local("offer", sp.snd(best.value.open_some()))
+        sp.verify(offer.value.amount >= min_amount, "OFFER_TOO_LOW")
+        self.fill_offer(sp.fst(best.value.open_some()), offer, 1)
 
     @sp.entry_point
     def retract_offer(self, offer_id):
         sp.set_type(offer_id, sp.TNat)
         self.is_paused()
-        sp.verify(self.data.offers.contains(offer_id), "INVALID_OFFER_ID")
-        sp.verify(self.data.offers[offer_id].creator == sp.sender, "INVALID_CREATOR")
-        sp.send(sp.sender, self.data.offers[offer_id].amount)
+        offer = sp.local("offer", self.data.offers.get_opt(offer_id).open_some("INVALID_OFFER_ID"))
+        sp.verify(offer.value.creator == sp.sender, "INVALID_CREATOR")
+        self.refund_offer(offer.value, self.escrowed_amount(offer.value))
+        self.unindex_offer(offer_id, offer.value)
         del self.data.offers[offer_id]
-        sp.emit(sp.record(offer_id=offer_id),tag="OFFER_RETRACTED")
+        Events.order("OFFER_RETRACTED", sp.some(offer_id), offer.value.token, sp.sender, offer.value.amount, 0)
+
+    @sp.entry_point
+    def update_offer(self, offer_id, amount, expiry_time):
+        sp.set_type(offer_id, sp.TNat)
+        sp.set_type(amount, sp.TMutez)
+        sp.set_type(expiry_time, sp.TOption(sp.TTimestamp))
+        self.is_paused()
+        offer = sp.local("offer", self.data.offers.get_opt(offer_id).open_some("INVALID_OFFER_ID"))
+        sp.verify(offer.value.creator == sp.sender, "INVALID_CREATOR")
+        escrowed = sp.local("escrowed", self.escrowed_amount(offer.value))
+        sp.if amount != offer.value.amount:
+            self.unindex_offer(offer_id, offer.value)
+            offer.value.amount = amount
+            self.index_offer(offer_id, offer.value)
+        sp.if expiry_time != offer.value.expiry_time:
+            offer.value.expiry_time = expiry_time
+            self.index_expiry(self.data.offer_expiries, self.data.offer_expiry_pages, offer_id, expiry_time)
+        required = sp.local("required", self.escrowed_amount(offer.value))
+        sp.if offer.value.use_deposit:
+            sp.verify(sp.amount == sp.mutez(0), "INVALID_AMOUNT")
+            self.check_deposit(sp.sender, required.value)
+        sp.else:
+            sp.if required.value > escrowed.value:
+                sp.verify(sp.amount == required.value - escrowed.value, "INVALID_AMOUNT")
+            sp.else:
+                sp.verify(sp.amount == sp.mutez(0), "INVALID_AMOUNT")
+                sp.if escrowed.value > required.value:
+                    sp.send(sp.sender, escrowed.value - required.value)
+        self.data.offers[offer_id] = offer.value
+        Events.order("OFFER_UPDATED", sp.some(offer_id), offer.value.token, offer.value.creator, amount, offer.value.quantity)
+
+    @sp.entry_point
+    def collection_offer(self, params):
+        sp.set_type(params, Collection_offer().type_value)
+        self.check_unit_offer(params)
+        self.data.collection_offers[self.data.next_collection_offer_id] = Collection_offer().set_value(params)
+        Events.collection_offer("COLLECTION_OFFER_CREATED", self.data.next_collection_offer_id, params.creator, params.address, params.amount, params.quantity)
+        self.data.next_collection_offer_id += 1
+
+    @sp.entry_point
+    def fulfill_collection_offer(self, offer_id, token_id):
+        sp.set_type(offer_id, sp.TNat)
+        sp.set_type(token_id, sp.TNat)
+        self.is_paused()
+        offer = sp.local("offer", self.data.collection_offers.get_opt(offer_id).open_some("INVALID_OFFER_ID"))
+        self.fill_unit_offer(self.data.collection_offers, offer_id, offer, sp.record(address = offer.value.address, token_id = token_id), "COLLECTION_OFFER_FULFILLED")
+
+    @sp.entry_point
+    def retract_collection_offer(self, offer_id):
+        sp.set_type(offer_id, sp.TNat)
+        offer = self.retract_unit_offer(self.data.collection_offers, offer_id)
+        Events.collection_offer("COLLECTION_OFFER_RETRACTED", offer_id, sp.sender, offer.value.address, offer.value.amount, 0)
+
+    @sp.entry_point
+    def trait_offer(self, params):
+        sp.set_type(params, Trait_offer().type_value)
+        self.check_unit_offer(params)
+        sp.verify(sp.len(params.merkle_root) == 32, "INVALID_MERKLE_ROOT")
+        self.data.trait_offers[self.data.next_trait_offer_id] = Trait_offer().set_value(params)
+        Events.trait_offer("TRAIT_OFFER_CREATED", self.data.next_trait_offer_id, params.creator, params.merkle_root, params.amount, params.quantity)
+        self.data.next_trait_offer_id += 1
+
+    @sp.entry_point
+    def fulfill_trait_offer(self, offer_id, token, proof):
+        sp.set_type(offer_id, sp.TNat)
+        sp.set_type(token, sp.TRecord(address = sp.TAddress, token_id = sp.TNat))
+        sp.set_type(proof, sp.TList(sp.TBytes))
+        self.is_paused()
+        offer = sp.local("offer", self.data.trait_offers.get_opt(offer_id).open_some("INVALID_OFFER_ID"))
+        sp.verify(self.merkle_root(sp.blake2b(sp.pack(token)), proof) == offer.value.merkle_root, "INVALID_PROOF")
+        self.fill_unit_offer(self.data.trait_offers, offer_id, offer, token, "TRAIT_OFFER_FULFILLED")
+
+    @sp.entry_point
+    def retract_trait_offer(self, offer_id):
+        sp.set_type(offer_id, sp.TNat)
+        offer = self.retract_unit_offer(self.data.trait_offers, offer_id)
+        Events.trait_offer("TRAIT_OFFER_RETRACTED", offer_id, sp.sender, offer.value.merkle_root, offer.value.amount, 0)
 
     @sp.entry_point
     def ask(self, params):
         sp.set_type(params, Ask().type_value)
         self.is_paused()
-        total_shares = sp.local("total_shares", self.data.platform_fees)
-        sp.for txn in params.shares:
-            total_shares.value += txn.amount
-        sp.verify(total_shares.value < 1000000, "INVALID_SHARES")
+        sp.verify(params.creator == sp.sender, "INVALID_CREATOR")
+        sp.verify(params.editions > 0, "INVALID_EDITIONS")
+        self.check_share_profile(params.share_profile_id)
+        self.check_transferable(params.token, sp.sender, params.editions)
         self.data.asks[self.data.next_ask_id] = Ask().set_value(params)
+        self.index_ask(self.data.next_ask_id, params)
+        self.index_expiry(self.data.ask_expiries, self.data.ask_expiry_pages, self.data.next_ask_id, params.expiry_time)
+        Events.order("ASK_CREATED", sp.some(self.data.next_ask_id), params.token, params.creator, params.amount, params.editions)
         self.data.next_ask_id += 1
-        sp.emit(sp.record(creator=params.creator,token=params.token),tag="ASK_CREATED")
 
     @sp.entry_point
-    def fulfill_ask(self, ask_id):
+    def ask_batch(self, params):
+        sp.set_type(params, Ask_batch().type_value)
+        self.is_paused()
+        self.check_share_profile(params.share_profile_id)
+        first_ask_id = sp.local("first_ask_id", self.data.next_ask_id)
+        next_ask_id = sp.local("next_ask_id", self.data.next_ask_id)
+        sp.for entry in params.entries:
+            sp.verify(entry.editions > 0, "INVALID_EDITIONS")
+            self.check_transferable(entry.token, sp.sender, entry.editions)
+            self.data.asks[next_ask_id.value] = Ask().set_value(sp.record(
+                creator = sp.sender,
+                token = entry.token,
+                amount = entry.amount,
+                editions = entry.editions,
+                expiry_time = entry.expiry_time,
+                share_profile_id = params.share_profile_id
+            ))
+            self.index_ask(next_ask_id.value, entry)
+            self.index_expiry(self.data.ask_expiries, self.data.ask_expiry_pages, next_ask_id.value, entry.expiry_time)
+            next_ask_id.value += 1
+        self.data.next_ask_id = next_ask_id.value
+        Events.batch("ASKS_CREATED", sp.sender, first_ask_id.value, sp.as_nat(next_ask_id.value - first_ask_id.value))
+
+    @sp.entry_point
+    def update_ask(self, ask_id, amount, editions, expiry_time):
         sp.set_type(ask_id, sp.TNat)
+        sp.set_type(amount, sp.TMutez)
+        sp.set_type(editions, sp.TNat)
+        sp.set_type(expiry_time, sp.TOption(sp.TTimestamp))
         self.is_paused()
-        sp.verify(self.data.asks.contains(ask_id), "INVALID_ASK_ID")
-        sp.verify(sp.amount == self.data.asks[ask_id].amount, "INVALID_AMOUNT")
-        transfer_amount = sp.local("transfer_amount", sp.amount)
-        sp.send(self.data.fund_operator, sp.split_tokens(transfer_amount.value, self.data.platform_fees, 1000000))
-        transfer_amount.value = transfer_amount.value - sp.split_tokens(transfer_amount.value, self.data.platform_fees, 1000000)
-        sp.for txn in self.data.asks[ask_id].shares:
-            sp.send(txn.recipient, sp.split_tokens(transfer_amount.value, txn.amount, 1000000))
-            transfer_amount.value = transfer_amount.value - sp.split_tokens(transfer_amount.value, txn.amount, 1000000)
-        sp.send(self.data.asks[ask_id].creator, transfer_amount.value)
+        ask = sp.local("ask", self.data.asks.get_opt(ask_id).open_some("INVALID_ASK_ID"))
+        sp.verify(ask.value.creator == sp.sender, "INVALID_CREATOR")
+        sp.verify(editions > 0, "INVALID_EDITIONS")
+        self.check_transferable(ask.value.token, sp.sender, editions)
+        sp.if amount != ask.value.amount:
+            self.unindex_ask(ask_id, ask.value)
+            ask.value.amount = amount
+            self.index_ask(ask_id, ask.value)
+        sp.if expiry_time != ask.value.expiry_time:
+            ask.value.expiry_time = expiry_time
+            self.index_expiry(self.data.ask_expiries, self.data.ask_expiry_pages, ask_id, expiry_time)
+        ask.value.editions = editions
+        self.data.asks[ask_id] = ask.value
+        Events.order("ASK_UPDATED", sp.some(ask_id), ask.value.token, ask.value.creator, amount, editions)
+
+    @sp.entry_point
+    def fulfill_ask(self, ask_id, quantity):
+        sp.set_type(ask_id, sp.TNat)
+        sp.set_type(quantity, sp.TNat)
+        self.is_paused()
+        ask = sp.local("ask", self.data.asks.get_opt(ask_id).open_some("INVALID_ASK_ID"))
+        sp.verify(sp.amount == self.fill_ask(ask_id, ask, quantity), "INVALID_AMOUNT")
+
+    @sp.entry_point
+    def buy_floor(self, token, max_price):
+        sp.set_type(token, t_token)
+        sp.set_type(max_price, sp.TMutez)
+        self.is_paused()
+        # Asks are only listed while their creator holds the editions and
+        # has made this contract an operator, but either may have changed
+        # since. The floor is the cheapest ask that is neither expired nor
+        # unfillable, so a stale ask is skipped instead of failing the call.
+        floor = sp.local("floor_ask", sp.none)
+        sp.for entry in self.data.ask_index.get_opt(token).open_some("NO_ASK").elements():
+            sp.if floor.value.is_none():
+                candidate = sp.local("candidate", self.data.asks[sp.snd(entry)])
+                sp.if ~ self.is_expired(candidate.value.expiry_time):
+                    sp.if self.transferable(candidate.value.token, candidate.value.creator) > 0:
+                        floor.value = sp.some(sp.pair(sp.snd(entry), candidate.value))
+        sp.verify(floor.value.is_some(), "NO_ASK")
+        ask = sp.local("ask", sp.snd(floor.value.open_some()))
+        sp.verify(ask.value.amount <= max_price, "PRICE_TOO_HIGH")
+        sp.verify(sp.amount >= ask.value.amount, "INVALID_AMOUNT")
+        self.fill_ask(sp.fst(floor.value.open_some()), ask, 1)
+        sp.if sp.amount > ask.value.amount:
+            sp.send(sp.sender, sp.amount - ask.value.amount)
+
+    @sp.entry_point
+    def fulfill_asks(self, ask_ids, skip_unavailable):
+        sp.set_type(ask_ids, sp.TList(sp.TNat))
+        sp.set_type(skip_unavailable, sp.TBool)
+        self.is_paused()
+        total_amount = sp.local("total_amount", sp.mutez(0))
+        transfers = sp.local("transfers", sp.map(tkey = sp.TAddress, tvalue = Batch_transfer.get_type()))
+        sp.for ask_id in ask_ids:
+            found = sp.local("found", self.data.asks.get_opt(ask_id))
+            available = sp.local("available", found.value.is_some())
+            sp.if available.value:
+                available.value = ~ self.is_expired(found.value.open_some().expiry_time)
+            sp.if available.value:
+                available.value = self.transferable(found.value.open_some().token, found.value.open_some().creator) > 0
+            sp.if available.value:
+                ask = sp.local("ask", found.value.open_some())
+                total_amount.value += ask.value.amount
+                payout = sp.local("sale_payout", self.pay_out(ask.value.amount, ask.value.token, ask.value.share_profile_id, ask.value.creator))
+                Stats.record_sale(self.data.collection_stats, ask.value.token.address, ask.value.amount, 1)
+                item = Batch_transfer.item(from_=ask.value.creator,
+                                       txs=[
+                                           sp.record(to_=sp.sender,
+                                                     amount=1,
+                                                     token_id=ask.value.token.token_id)
+                                       ])
+                sp.if transfers.value.contains(ask.value.token.address):
+                    transfers.value[ask.value.token.address].push(item)
+                sp.else:
+                    transfers.value[ask.value.token.address] = [item]
+                ask.value.editions = sp.as_nat(ask.value.editions - sp.nat(1))
+                sp.if ask.value.editions == 0:
+                    self.unindex_ask(ask_id, ask.value)
+                    del self.data.asks[ask_id]
+                sp.else:
+                    self.data.asks[ask_id] = ask.value
+                Events.sale("ASK_FULFILLED", sp.some(ask_id), ask.value.token, ask.value.creator, sp.sender,
+                            ask.value.amount, 1, ask.value.editions, payout.value)
+            sp.else:
+                sp.verify(skip_unavailable, "INVALID_ASK_ID")
+        sp.if skip_unavailable:
+            sp.verify(sp.amount >= total_amount.value, "INVALID_AMOUNT")
+            sp.if sp.amount > total_amount.value:
+                sp.send(sp.sender, sp.amount - total_amount.value)
+        sp.else:
+            sp.verify(sp.amount == total_amount.value, "INVALID_AMOUNT")
+        sp.for transfer in transfers.value.items():
+            self.transfer_token(transfer.key, transfer.value)
+
+    @sp.entry_point
+    def fulfill_signed_ask(self, order, signature):
+        sp.set_type(order, Signed_ask().type_value)
+        sp.set_type(signature, sp.TSignature)
+        self.is_paused()
+        sp.verify(sp.check_signature(order.public_key, signature, Signed_ask().pack(sp.self_address, order)), "INVALID_SIGNATURE")
+        self.check_expiry(order.expiry_time)
+        sp.verify(sp.amount == order.amount, "INVALID_AMOUNT")
+        creator = sp.local("creator", sp.to_address(sp.implicit_account(sp.hash_key(order.public_key))))
+        self.use_nonce(creator.value, order.nonce)
+        payout = sp.local("sale_payout", self.pay_out(sp.amount, order.token, order.share_profile_id, creator.value))
+        Stats.record_sale(self.data.collection_stats, order.token.address, order.amount, 1)
         _params = [
-                Batch_transfer.item(from_=self.data.asks[ask_id].creator,
+                Batch_transfer.item(from_=creator.value,
                                        txs=[
                                            sp.record(to_=sp.sender,
                                                      amount=1,
-                                                     token_id=self.data.asks[ask_id].token.token_id)
+                                                     token_id=order.token.token_id)
                                        ])
             ]
-        self.transfer_token(self.data.asks[ask_id].token.address, _params)
-        self.data.asks[ask_id].editions = sp.as_nat(self.data.asks[ask_id].editions - sp.nat(1))
-        sp.if self.data.asks[ask_id].editions == 0:
-            del self.data.asks[ask_id]
-        sp.emit(sp.record(ask_id=ask_id,fulfilled_by=sp.sender),tag="ASK_FULFILLED")
+        self.transfer_token(order.token.address, _params)
+        Events.sale("SIGNED_ASK_FULFILLED", sp.some(order.nonce), order.token, creator.value, sp.sender,
+                    order.amount, 1, 0, payout.value)
+
+    @sp.entry_point
+    def cancel_signed_ask(self, nonce):
+        sp.set_type(nonce, sp.TNat)
+        self.use_nonce(sp.sender, nonce)
+        Events.nonce("SIGNED_ASK_CANCELLED", sp.sender, nonce)
 
     @sp.entry_point
     def retract_ask(self, ask_id):
         sp.set_type(ask_id, sp.TNat)
         self.is_paused()
-        sp.verify(self.data.asks.contains(ask_id), "INVALID_ASK_ID")
-        sp.verify(self.data.asks[ask_id].creator == sp.sender, "INVALID_CREATOR")
+        ask = sp.local("ask", self.data.asks.get_opt(ask_id).open_some("INVALID_ASK_ID"))
+        sp.verify(ask.value.creator == sp.sender, "INVALID_CREATOR")
+        self.unindex_ask(ask_id, ask.value)
         del self.data.asks[ask_id]
-        sp.emit(sp.record(ask_id=ask_id),tag="ASK_RETRACTED")
+        Events.order("ASK_RETRACTED", sp.some(ask_id), ask.value.token, sp.sender, ask.value.amount, 0)
     
+    @sp.entry_point
+    def sweep_expired(self, bucket, page, max_items):
+        sp.set_type(bucket, sp.TNat)
+        sp.set_type(page, sp.TNat)
+        sp.set_type(max_items, sp.TNat)
+        swept = sp.local("swept", sp.nat(0))
+        self.sweep_bucket("ask", self.data.ask_expiries, bucket, page, max_items, swept, self.sweep_ask)
+        self.sweep_bucket("offer", self.data.offer_expiries, bucket, page, max_items, swept, self.sweep_offer)
+        Events.sweep("EXPIRED_SWEPT", bucket, page, swept.value)
+
+    @sp.entry_point
+    def deposit(self):
+        self.is_paused()
+        sp.verify(sp.amount > sp.mutez(0), "INVALID_AMOUNT")
+        self.data.deposits[sp.sender] = self.data.deposits.get(sp.sender, sp.mutez(0)) + sp.amount
+        Events.funds("DEPOSITED", sp.sender, sp.amount)
+
+    @sp.entry_point
+    def withdraw_deposit(self, amount):
+        # Deposits are kept apart from accrued payouts so that only their
+        # owner can ever move them; withdraw_for never touches them.
+        sp.set_type(amount, sp.TMutez)
+        sp.verify(amount > sp.mutez(0), "INVALID_AMOUNT")
+        self.debit_deposit(sp.sender, amount)
+        sp.send(sp.sender, amount)
+        Events.funds("DEPOSIT_WITHDRAWN", sp.sender, amount)
+
+    @sp.entry_point
+    def sweep_fees(self, amount):
+        sp.set_type(amount, sp.TOption(sp.TMutez))
+        sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
+        Payout.sweep_fees(self.data, amount)
+
+    @sp.entry_point
+    def toggle_accrue_payouts(self):
+        sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
+        self.data.accrue_payouts = ~self.data.accrue_payouts
+
+    @sp.entry_point
+    def withdraw(self):
+        sp.verify(self.data.balances.contains(sp.sender), "NO_BALANCE")
+        Payout.withdraw(self.data, sp.sender)
+
+    @sp.entry_point
+    def withdraw_for(self, recipients):
+        sp.set_type(recipients, sp.TList(sp.TAddress))
+        sp.for recipient in recipients:
+            Payout.withdraw(self.data, recipient)
+
     @sp.entry_point
     def toggle_pause(self):
         sp.verify(self.data.mods.contains(sp.sender), "NOT_MODERATOR")
         self.data.pause = ~self.data.pause
 
+    @sp.onchain_view()
+    def get_ask(self, ask_id):
+        """Get an open ask."""
+        sp.set_type(ask_id, sp.TNat)
+        sp.result(self.data.asks.get_opt(ask_id).open_some("INVALID_ASK_ID"))
+
+    @sp.onchain_view()
+    def get_offer(self, offer_id):
+        """Get an open offer."""
+        sp.set_type(offer_id, sp.TNat)
+        sp.result(self.data.offers.get_opt(offer_id).open_some("INVALID_OFFER_ID"))
+
+    @sp.onchain_view()
+    def get_collection_stats(self, address):
+        """Get the sale statistics of an FA2 contract, all zero if nothing
+        from it has been sold yet."""
+        sp.set_type(address, sp.TAddress)
+        sp.result(self.data.collection_stats.get(address, Stats.empty()))
+
+    @sp.onchain_view()
+    def preview_payout(self, params):
+        """Get the platform fee and the per-recipient payouts that filling
+        `quantity` editions of an ask would produce. Fails like
+        `fulfill_ask` would if the ask cannot be filled."""
+        sp.set_type(params, sp.TRecord(ask_id = sp.TNat, quantity = sp.TNat))
+        ask = sp.local("ask", self.data.asks.get_opt(params.ask_id).open_some("INVALID_ASK_ID"))
+        self.check_fill_ask(ask.value, params.quantity)
+        sp.result(Payout.split(self.data, sp.split_tokens(ask.value.amount, params.quantity, 1),
+                               ask.value.token, ask.value.creator,
+                               self.data.share_profiles[ask.value.share_profile_id]))
+
+
+sp.add_compilation_target("marketplace", Marketplace(
+    mods=[sp.address("tz1XzzMGjiJWVLAsdsqSNjgu7SuPvVw7JjGM")],
+    fund_operator=sp.address("tz1XzzMGjiJWVLAsdsqSNjgu7SuPvVw7JjGM")))
+
+sp.add_compilation_target("marketplace_lazy", Marketplace(
+    mods=[sp.address("tz1XzzMGjiJWVLAsdsqSNjgu7SuPvVw7JjGM")],
+    fund_operator=sp.address("tz1XzzMGjiJWVLAsdsqSNjgu7SuPvVw7JjGM"),
+    lazy_entry_points=True))
 
+@sp.add_test(name="Marketplace lazy entry points")
+def test():
+    sc = sp.test_scenario()
+    sc.h1("Marketplace: eager vs lazy entry points")
+    sc.p("Compare the gas of each fulfill_ask call below; only the entry point being called is loaded from a lazy contract.")
+    sc.table_of_contents()
+    admin           =   sp.address("tz1ooADMIN")
+    alice           =   sp.address("tz1ooALICE")
+    elon            =   sp.address("tz1ooELON")
+    fund_operator   =   sp.address("tz1ooFUNDoOP")
+
+    metadata = sp.map({"": sp.utils.bytes_of_string("https://example.com")})
+    fa2 = FA2_contract.FA2(config=environment_config(), metadata=metadata, admin=admin)
+    sc += fa2
+
+    for token_id, lazy in enumerate([False, True]):
+        sc.h2("Lazy entry points" if lazy else "Eager entry points")
+        mp = Marketplace(mods = [admin], fund_operator = fund_operator, lazy_entry_points = lazy)
+        sc += mp
+        fa2.mint(address=alice,
+                 amount=1,
+                 metadata=metadata,
+                 royalties=[],
+                 token_id=token_id).run(sender=admin)
+        sc += fa2.update_operators([
+                    sp.variant("add_operator", Operator_param().make(
+                        owner=alice,
+                        operator=mp.address,
+                        token_id=token_id))]).run(sender=alice)
+        sc += mp.ask(sp.record(
+            creator = alice,
+            token = sp.record(address = fa2.address, token_id = sp.nat(token_id)),
+            amount = sp.tez(1),
+            editions = sp.nat(1),
+            expiry_time = sp.none,
+            share_profile_id = sp.nat(0)
+        )).run(sender = alice)
+        sc.h3("fulfill_ask")
+        sc += mp.fulfill_ask(ask_id = sp.nat(0), quantity = sp.nat(1)).run(sender = elon, amount = sp.tez(1))
+
+@sp.add_test(name="Marketplace collection stats")
+def test():
+    sc = sp.test_scenario()
+    sc.h1("Marketplace: collection stats")
+    sc.table_of_contents()
+    admin           =   sp.address("tz1ooADMIN")
+    alice           =   sp.address("tz1ooALICE")
+    elon            =   sp.address("tz1ooELON")
+    fund_operator   =   sp.address("tz1ooFUNDoOP")
+
+    metadata = sp.map({"": sp.utils.bytes_of_string("https://example.com")})
+    fa2 = FA2_contract.FA2(config=environment_config(), metadata=metadata, admin=admin)
+    sc += fa2
+    mp = Marketplace(mods = [admin], fund_operator = fund_operator)
+    sc += mp
+    token = sp.record(address = fa2.address, token_id = sp.nat(0))
+    fa2.mint(address=alice,
+             amount=10,
+             metadata=metadata,
+             royalties=[],
+             token_id=0).run(sender=admin)
+    sc += fa2.update_operators([
+                sp.variant("add_operator", Operator_param().make(
+                    owner=alice,
+                    operator=mp.address,
+                    token_id=0))]).run(sender=alice)
+    sc += mp.ask_batch(sp.record(
+        entries = [
+            sp.record(token = token, amount = sp.tez(2), editions = sp.nat(5), expiry_time = sp.none),
+            sp.record(token = token, amount = sp.tez(1), editions = sp.nat(1), expiry_time = sp.none)
+        ],
+        share_profile_id = sp.nat(0)
+    )).run(sender = alice)
+
+    sc.h2("First sale: 3 editions at 2 tez")
+    sc += mp.fulfill_ask(ask_id = sp.nat(0), quantity = sp.nat(3)).run(sender = elon, amount = sp.tez(6))
+    stats = mp.get_collection_stats(fa2.address)
+    sc.verify(stats.last_price == sp.tez(2))
+    sc.verify(stats.average_price == sp.tez(2))
+    sc.verify(stats.volume == sp.tez(6))
+    sc.verify(stats.sales == 3)
+
+    sc.h2("Second sale: 1 edition at 1 tez")
+    sc.p("The average moves by a tenth of the difference, 2 * 0.9 + 1 * 0.1 = 1.9 tez.")
+    sc += mp.fulfill_ask(ask_id = sp.nat(1), quantity = sp.nat(1)).run(sender = elon, amount = sp.tez(1))
+    stats = mp.get_collection_stats(fa2.address)
+    sc.verify(stats.last_price == sp.tez(1))
+    sc.verify(stats.average_price == sp.mutez(1900000))
+    sc.verify(stats.volume == sp.tez(7))
+    sc.verify(stats.sales == 4)
+    sc.verify(mp.get_collection_stats(admin).sales == 0)
+
+@sp.add_test(name="Marketplace order book")
+def test():
+    sc = sp.test_scenario()
+    sc.h1("Marketplace: bounded order book")
+    sc.table_of_contents()
+    admin           =   sp.address("tz1ooADMIN")
+    alice           =   sp.address("tz1ooALICE")
+    bob             =   sp.address("tz1ooBOB")
+    fund_operator   =   sp.address("tz1ooFUNDoOP")
+
+    metadata = sp.map({"": sp.utils.bytes_of_string("https://example.com")})
+    fa2 = FA2_contract.FA2(config=environment_config(), metadata=metadata, admin=admin)
+    sc += fa2
+    mp = Marketplace(mods = [admin], fund_operator = fund_operator)
+    sc += mp
+    token = sp.record(address = fa2.address, token_id = sp.nat(0))
+    fa2.mint(address=alice,
+             amount=30,
+             metadata=metadata,
+             royalties=[],
+             token_id=0).run(sender=admin)
+    sc += fa2.update_operators([
+                sp.variant("add_operator", Operator_param().make(
+                    owner=alice,
+                    operator=mp.address,
+                    token_id=0))]).run(sender=alice)
+
+    sc.h2("Asks")
+    sc.p("Ask 0 expires at 100, asks 0 to 19 are listed at 1 to 20 tez.")
+    sc += mp.ask_batch(sp.record(
+        entries = [sp.record(token = token,
+                             amount = sp.tez(i + 1),
+                             editions = sp.nat(1),
+                             expiry_time = sp.some(sp.timestamp(100)) if i == 0 else sp.none)
+                   for i in range(order_book_size)],
+        share_profile_id = sp.nat(0)
+    )).run(sender = alice)
+    sc.verify(sp.len(mp.data.ask_index[token]) == order_book_size)
+    ask_data = sp.record(
+        creator = alice,
+        token = token,
+        amount = sp.tez(21),
+        editions = sp.nat(1),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )
+    sc += mp.ask(ask_data).run(sender = alice, valid = False)
+    sc += mp.ask(sp.record(
+        creator = alice,
+        token = token,
+        amount = sp.mutez(500000),
+        editions = sp.nat(1),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )).run(sender = alice)
+    sc.verify(~ mp.data.asks.contains(19))
+    sc.verify(sp.len(mp.data.ask_index[token]) == order_book_size)
+    sc.p("Once ask 0 has expired it makes room for a more expensive ask.")
+    sc += mp.ask(ask_data).run(sender = alice, now = sp.timestamp(200))
+    sc.verify(~ mp.data.asks.contains(0))
+    sc.verify(mp.data.asks.contains(21))
+    sc.verify(sp.len(mp.data.ask_index[token]) == order_book_size)
+
+    sc.h2("Offers")
+    sc.p("Offer 19 expires at 100, offers 0 to 19 bid 1 to 20 mutez.")
+    sc += mp.offer_batch([sp.record(creator = bob,
+                                    token = token,
+                                    amount = sp.mutez(i + 1),
+                                    quantity = sp.nat(1),
+                                    use_deposit = sp.bool(False),
+                                    expiry_time = sp.some(sp.timestamp(100)) if i == order_book_size - 1 else sp.none,
+                                    share_profile_id = sp.nat(0))
+                          for i in range(order_book_size)]).run(sender = bob, amount = sp.mutez(210))
+    sc.verify(sp.len(mp.data.offer_index[token]) == order_book_size)
+    offer_data = sp.record(
+        creator = bob,
+        token = token,
+        amount = sp.mutez(1),
+        quantity = sp.nat(1),
+        use_deposit = sp.bool(False),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )
+    sc += mp.offer(offer_data).run(sender = bob, amount = sp.mutez(1), valid = False)
+    sc += mp.offer(sp.record(
+        creator = bob,
+        token = token,
+        amount = sp.mutez(30),
+        quantity = sp.nat(1),
+        use_deposit = sp.bool(False),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )).run(sender = bob, amount = sp.mutez(30))
+    sc.verify(~ mp.data.offers.contains(0))
+    sc.verify(mp.data.deposits[bob] == sp.mutez(1))
+    sc.p("Once offer 19 has expired it makes room for a lower offer; evicted escrow goes to Bob's deposit.")
+    sc += mp.offer(sp.record(
+        creator = bob,
+        token = token,
+        amount = sp.mutez(2),
+        quantity = sp.nat(1),
+        use_deposit = sp.bool(False),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )).run(sender = bob, amount = sp.mutez(2), now = sp.timestamp(200))
+    sc.verify(~ mp.data.offers.contains(19))
+    sc.verify(mp.data.offers.contains(21))
+    sc.verify(mp.data.deposits[bob] == sp.mutez(21))
+    sc.verify(sp.len(mp.data.offer_index[token]) == order_book_size)
+    sc += mp.withdraw_deposit(sp.mutez(21)).run(sender = bob)
 
 @sp.add_test(name="Marketplace")
 def test():
@@ -321,11 +1294,24 @@ def test():
     sc += mp.add_moderator(alice).run(sender = admin)
     sc += mp.remove_moderator(alice).run(sender = admin)
     
+    sc.h1("Marketplace: Register share profiles")
+    sc += mp.register_share_profile([get_share.make(recipient= admin, amount=sp.nat(400))]).run(sender = admin)
+    sc += mp.register_share_profile([get_share.make(recipient= admin, amount=sp.nat(40000)),
+                                     get_share.make(recipient= mark, amount=sp.nat(5000)),
+                                     get_share.make(recipient= mark, amount=sp.nat(5000)),
+                                     get_share.make(recipient= mark, amount=sp.nat(50000)),
+                                     get_share.make(recipient= bob, amount=sp.nat(5000))]).run(sender = alice)
+    sc += mp.register_share_profile([get_share.make(recipient= admin, amount=sp.nat(100000))]).run(sender = bob)
+    sc += mp.register_share_profile([get_share.make(recipient= mark, amount=sp.nat(50000))]).run(sender = alice)
+    sc += mp.register_share_profile([get_share.make(recipient= mark, amount=sp.nat(990000))]).run(sender = alice, valid = False)
+    sc.verify(mp.data.next_share_profile_id == 5)
+
     sc.h1("FA2: Mint tokens")
     fa2.mint(address=alice,
                 amount=50,
                 metadata=sp.map({"": sp.utils.bytes_of_string(
                     "https://ipfs.io/ipfs/bafyreias7kz2ryktu34afqwh56pltm32uxsecaxsootklwlsquw5gn3ptq/metadata.json/")}),
+                royalties=[get_share.make(recipient= bob, amount=sp.nat(10000))],
                 token_id=0).run(sender=admin)
     
     sc.h1("Marketplace: Create Offer")
@@ -336,8 +1322,10 @@ def test():
             token_id = sp.nat(0)
         ),
         amount = sp.tez(1),
+        quantity = sp.nat(1),
+        use_deposit = sp.bool(False),
         expiry_time = sp.some(sp.timestamp(5)),
-        shares = [get_share.make(recipient= admin, amount=sp.nat(400))]
+        share_profile_id = sp.nat(1)
     )
     sc += mp.offer(offer_data).run(sender = admin, amount = sp.tez(1))
     sc.show([sp.record(contract_balance = mp.balance)])
@@ -348,13 +1336,47 @@ def test():
             token_id = sp.nat(0)
         ),
         amount = sp.tez(5),
+        quantity = sp.nat(1),
+        use_deposit = sp.bool(False),
         expiry_time = sp.none,
-        shares = [get_share.make(recipient= admin, amount=sp.nat(400))]
+        share_profile_id = sp.nat(1)
     )
 
     sc += mp.offer(offer_data).run(sender = bob, amount = sp.tez(5))
     sc.show([sp.record(contract_balance = mp.balance)])
     
+    sc.h1("Marketplace: Create Offers in batch")
+    offer_batch_data = [
+        sp.record(
+            creator = bob,
+            token = sp.record(
+                address = fa2.address,
+                token_id = sp.nat(0)
+            ),
+            amount = sp.tez(2),
+            quantity = sp.nat(1),
+            use_deposit = sp.bool(False),
+            expiry_time = sp.none,
+            share_profile_id = sp.nat(1)
+        ),
+        sp.record(
+            creator = bob,
+            token = sp.record(
+                address = fa2.address,
+                token_id = sp.nat(1)
+            ),
+            amount = sp.tez(3),
+            quantity = sp.nat(1),
+            use_deposit = sp.bool(False),
+            expiry_time = sp.none,
+            share_profile_id = sp.nat(1)
+        )
+    ]
+    sc += mp.offer_batch(offer_batch_data).run(sender = bob, amount = sp.tez(4), valid = False)
+    sc += mp.offer_batch(offer_batch_data).run(sender = bob, amount = sp.tez(5))
+    sc.verify(mp.data.next_offer_id == 4)
+    sc.show([sp.record(contract_balance = mp.balance)])
+
     sc.h1("Marketplace: Fulfill Offer")
     
     sc.h2("FA2: Update operators")
@@ -364,7 +1386,76 @@ def test():
                     operator=mp.address,
                     token_id=0))]).run(sender=alice)
     
-    sc += mp.fulfill_offer(sp.nat(0)).run(sender = alice)
+    sc += mp.fulfill_offer(offer_id = sp.nat(0), quantity = sp.nat(1)).run(sender = alice)
+
+    sc.h1("Marketplace: Accept Best Offer")
+    sc.verify(sp.len(mp.data.offer_index[sp.record(address = fa2.address, token_id = sp.nat(0))]) == 1)
+    sc += mp.accept_best_offer(token = sp.record(address = fa2.address, token_id = sp.nat(0)), min_amount = sp.tez(3)).run(sender = alice, valid = False)
+    sc += mp.accept_best_offer(token = sp.record(address = fa2.address, token_id = sp.nat(0)), min_amount = sp.tez(2)).run(sender = alice)
+    sc.verify(~ mp.data.offer_index.contains(sp.record(address = fa2.address, token_id = sp.nat(0))))
+    sc.verify(~ mp.data.offers.contains(2))
+
+    sc.h1("Marketplace: Partial Offer Fills")
+    multi_offer = sp.record(
+        creator = elon,
+        token = sp.record(
+            address = fa2.address,
+            token_id = sp.nat(0)
+        ),
+        amount = sp.tez(1),
+        quantity = sp.nat(3),
+        use_deposit = sp.bool(False),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )
+    sc += mp.offer(multi_offer).run(sender = elon, amount = sp.tez(1), valid = False)
+    sc += mp.offer(multi_offer).run(sender = elon, amount = sp.tez(3))
+    sc += mp.fulfill_offer(offer_id = sp.nat(4), quantity = sp.nat(4)).run(sender = alice, valid = False)
+    sc += mp.fulfill_offer(offer_id = sp.nat(4), quantity = sp.nat(2)).run(sender = alice)
+    sc.verify(mp.data.offers[4].quantity == 1)
+    sc += mp.update_offer(offer_id = sp.nat(4), amount = sp.tez(2), expiry_time = sp.none).run(sender = elon, valid = False)
+    sc += mp.update_offer(offer_id = sp.nat(4), amount = sp.tez(2), expiry_time = sp.none).run(sender = elon, amount = sp.tez(1))
+    sc.verify(mp.data.offers[4].amount == sp.tez(2))
+    sc += mp.update_offer(offer_id = sp.nat(4), amount = sp.tez(1), expiry_time = sp.some(sp.timestamp(7200))).run(sender = elon)
+    sc.verify(mp.data.offer_expiries[sp.pair(2, 0)].contains(4))
+    sc += mp.retract_offer(sp.nat(4)).run(sender = elon)
+
+    sc.h1("Marketplace: Collection Offer")
+    collection_offer_data = sp.record(
+        creator = elon,
+        address = fa2.address,
+        amount = sp.tez(1),
+        quantity = sp.nat(2),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )
+    sc += mp.collection_offer(collection_offer_data).run(sender = elon, amount = sp.tez(1), valid = False)
+    sc += mp.collection_offer(collection_offer_data).run(sender = elon, amount = sp.tez(2))
+    sc += mp.fulfill_collection_offer(offer_id = sp.nat(0), token_id = sp.nat(0)).run(sender = alice)
+    sc.verify(mp.data.collection_offers[0].quantity == 1)
+    sc += mp.retract_collection_offer(sp.nat(0)).run(sender = alice, valid = False)
+    sc += mp.retract_collection_offer(sp.nat(0)).run(sender = elon)
+    sc.verify(~ mp.data.collection_offers.contains(0))
+
+    sc.h1("Marketplace: Trait Offer")
+    sc.p("The merkle tree covers tokens 0 and 1 of the FA2 contract.")
+    leaf_0 = sc.compute(sp.blake2b(sp.pack(sp.record(address = fa2.address, token_id = sp.nat(0)))))
+    leaf_1 = sc.compute(sp.blake2b(sp.pack(sp.record(address = fa2.address, token_id = sp.nat(1)))))
+    merkle_root = sc.compute(sp.eif(leaf_0 < leaf_1,
+                                    sp.blake2b(sp.concat([leaf_0, leaf_1])),
+                                    sp.blake2b(sp.concat([leaf_1, leaf_0]))))
+    trait_offer_data = sp.record(
+        creator = elon,
+        merkle_root = merkle_root,
+        amount = sp.tez(1),
+        quantity = sp.nat(1),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )
+    sc += mp.trait_offer(trait_offer_data).run(sender = elon, amount = sp.tez(1))
+    sc += mp.fulfill_trait_offer(offer_id = sp.nat(0), token = sp.record(address = fa2.address, token_id = sp.nat(0)), proof = [leaf_0]).run(sender = alice, valid = False)
+    sc += mp.fulfill_trait_offer(offer_id = sp.nat(0), token = sp.record(address = fa2.address, token_id = sp.nat(0)), proof = [leaf_1]).run(sender = alice)
+    sc.verify(~ mp.data.trait_offers.contains(0))
 
     sc.h1("Marketplace: Retract Offer")
     sc += mp.retract_offer(sp.nat(1)).run(sender = bob)
@@ -374,17 +1465,13 @@ def test():
     ask_data = sp.record(
         creator = alice,
         token = sp.record(
-            address = sp.address("KT1Tezooo1zzSmartPyzzSTATiCzzzyfC8eF"),
+            address = fa2.address,
             token_id = sp.nat(0)
         ),
         amount = sp.tez(100),
         editions = sp.nat(2),
         expiry_time = sp.some(sp.timestamp(5)),
-        shares = [get_share.make(recipient= admin, amount=sp.nat(40000)),
-                  get_share.make(recipient= mark, amount=sp.nat(5000)),
-                  get_share.make(recipient= mark, amount=sp.nat(5000)),
-                  get_share.make(recipient= mark, amount=sp.nat(50000)),
-                  get_share.make(recipient= bob, amount=sp.nat(5000))]
+        share_profile_id = sp.nat(2)
     )
     
     sc.h2("FA2: Update operators")
@@ -396,23 +1483,249 @@ def test():
     
     sc += mp.ask(ask_data).run(sender = alice)
 
+    sc.h2("Asks need the editions and an operator")
+    sc += fa2.transfer([Batch_transfer.item(from_ = alice,
+                                            txs = [sp.record(to_ = bob, amount = 4, token_id = 0)])]).run(sender = alice)
     ask_data = sp.record(
         creator = bob,
         token = sp.record(
-            address = sp.address("KT1TezoooozzSmartPyzzDYNAMiCzzpLu4LU"),
+            address = fa2.address,
             token_id = sp.nat(0)
         ),
         amount = sp.tez(5),
         editions = sp.nat(5),
         expiry_time = sp.none,
-        shares = [get_share.make(recipient= admin, amount=sp.nat(100000))]
+        share_profile_id = sp.nat(3)
     )
+    sc += mp.ask(ask_data).run(sender = alice, valid = False)
+    sc += mp.ask(ask_data).run(sender = bob, valid = False)
+    sc += fa2.update_operators([
+                sp.variant("add_operator", Operator_param().make(
+                    owner=bob,
+                    operator=mp.address,
+                    token_id=0))]).run(sender=bob)
+    sc += mp.ask(sp.record(
+        creator = bob,
+        token = ask_data.token,
+        amount = sp.tez(5),
+        editions = sp.nat(6),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(3)
+    )).run(sender = bob, valid = False)
+    sc += mp.ask(sp.record(
+        creator = bob,
+        token = ask_data.token,
+        amount = sp.tez(1),
+        editions = sp.nat(0),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )).run(sender = bob, valid = False)
     sc += mp.ask(ask_data).run(sender = bob)
     sc.show([sp.record(contract_balance = mp.balance)])
 
+    sc.h1("Marketplace: Create Asks in batch")
+    ask_batch_data = sp.record(
+        entries = [
+            sp.record(
+                token = sp.record(
+                    address = fa2.address,
+                    token_id = sp.nat(0)
+                ),
+                amount = sp.tez(3),
+                editions = sp.nat(1),
+                expiry_time = sp.none
+            ),
+            sp.record(
+                token = sp.record(
+                    address = fa2.address,
+                    token_id = sp.nat(0)
+                ),
+                amount = sp.tez(4),
+                editions = sp.nat(2),
+                expiry_time = sp.none
+            )
+        ],
+        share_profile_id = sp.nat(4)
+    )
+    sc += mp.ask_batch(ask_batch_data).run(sender = alice)
+    sc.verify(mp.data.next_ask_id == 4)
+
+    sc.h1("Marketplace: Views")
+    sc.verify(mp.get_ask(0).editions == 2)
+    sc.verify(mp.get_offer(3).amount == sp.tez(3))
+    sc.verify(mp.preview_payout(sp.record(ask_id = 0, quantity = 1)).fee == sp.tez(2))
+    sc.verify(mp.preview_payout(sp.record(ask_id = 0, quantity = 1)).payouts[admin] == sp.mutez(3920000))
+    sc.verify(sp.is_failing(mp.preview_payout(sp.record(ask_id = 0, quantity = 0))))
+    sc.verify(sp.is_failing(mp.preview_payout(sp.record(ask_id = 0, quantity = 3))))
+
     sc.h1("Marketplace: Fulfill Ask")
-    sc += mp.fulfill_ask(sp.nat(0)).run(sender = elon, amount = sp.tez(100))
+    sc += mp.fulfill_ask(ask_id = sp.nat(0), quantity = sp.nat(2)).run(sender = elon, amount = sp.tez(100), valid = False)
+    sc += mp.fulfill_ask(ask_id = sp.nat(0), quantity = sp.nat(3)).run(sender = elon, amount = sp.tez(300), valid = False)
+    sc += mp.fulfill_ask(ask_id = sp.nat(0), quantity = sp.nat(1)).run(sender = elon, amount = sp.tez(100))
     sc.show([sp.record(contract_balance = mp.balance)])
 
+    sc.h1("Marketplace: Update Ask")
+    sc += mp.update_ask(ask_id = sp.nat(1), amount = sp.tez(6), editions = sp.nat(4), expiry_time = sp.none).run(sender = alice, valid = False)
+    sc += mp.update_ask(ask_id = sp.nat(1), amount = sp.tez(6), editions = sp.nat(4), expiry_time = sp.none).run(sender = bob)
+    sc += mp.update_ask(ask_id = sp.nat(1), amount = sp.tez(5), editions = sp.nat(5), expiry_time = sp.none).run(sender = bob)
+    sc.verify(mp.data.asks[1].editions == 5)
+
+    sc.h1("Marketplace: Fulfill Asks")
+    sc.p("Ask 7 does not exist and is skipped, the extra 1 tez is refunded.")
+    sc += mp.fulfill_asks(ask_ids = [sp.nat(0), sp.nat(1), sp.nat(7)], skip_unavailable = True).run(sender = elon, amount = sp.tez(106))
+    sc += mp.fulfill_asks(ask_ids = [sp.nat(1), sp.nat(7)], skip_unavailable = False).run(sender = elon, amount = sp.tez(5), valid = False)
+    sc.show([sp.record(contract_balance = mp.balance)])
+
+    sc.h1("Marketplace: Signed Asks")
+    seller = sp.test_account("Seller")
+    fa2.mint(address=seller.address,
+                amount=1,
+                metadata=sp.map({"": sp.utils.bytes_of_string(
+                    "https://ipfs.io/ipfs/bafyreias7kz2ryktu34afqwh56pltm32uxsecaxsootklwlsquw5gn3ptq/metadata.json/")}),
+                royalties=[],
+                token_id=1).run(sender=admin)
+    sc += fa2.update_operators([
+                sp.variant("add_operator", Operator_param().make(
+                    owner=seller.address,
+                    operator=mp.address,
+                    token_id=1))]).run(sender=seller)
+    signed_ask = sp.record(
+        public_key = seller.public_key,
+        token = sp.record(
+            address = fa2.address,
+            token_id = sp.nat(1)
+        ),
+        amount = sp.tez(2),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0),
+        nonce = sp.nat(300)
+    )
+    signature = sp.make_signature(seller.secret_key, Signed_ask().pack(mp.address, signed_ask), message_format = "Raw")
+    sc += mp.fulfill_signed_ask(order = signed_ask, signature = signature).run(sender = elon, amount = sp.tez(1), valid = False)
+    sc += mp.fulfill_signed_ask(order = signed_ask, signature = signature).run(sender = elon, amount = sp.tez(2))
+    sc += mp.fulfill_signed_ask(order = signed_ask, signature = signature).run(sender = elon, amount = sp.tez(2), valid = False)
+    sc += mp.cancel_signed_ask(sp.nat(301)).run(sender = seller)
+    sc += mp.cancel_signed_ask(sp.nat(301)).run(sender = seller, valid = False)
+
     sc.h1("Marketplace: Retract Ask")
-    sc += mp.retract_ask(sp.nat(1)).run(sender = bob)
\ No newline at end of file
+    sc += mp.retract_ask(sp.nat(1)).run(sender = bob)
+
+    sc.h1("Marketplace: Accrued payouts")
+    sc += mp.toggle_accrue_payouts().run(sender = alice, valid = False)
+    sc += mp.toggle_accrue_payouts().run(sender = admin)
+    sc += mp.fulfill_ask(ask_id = sp.nat(2), quantity = sp.nat(1)).run(sender = elon, amount = sp.tez(3))
+    sc.verify(mp.data.balances.contains(mark) & mp.data.balances.contains(alice))
+    sc += mp.withdraw().run(sender = mark)
+    sc += mp.withdraw().run(sender = mark, valid = False)
+    sc += mp.withdraw_for([alice, fund_operator]).run(sender = elon)
+    sc.verify(~ mp.data.balances.contains(alice))
+    sc.show([sp.record(contract_balance = mp.balance)])
+
+    sc.h1("Marketplace: Collection stats")
+    sc.verify(mp.get_collection_stats(fa2.address).sales > 0)
+    sc.verify(mp.get_collection_stats(admin).sales == 0)
+
+    sc.h1("Marketplace: Sweep platform fees")
+    sc.show([sp.record(accrued_fees = mp.data.accrued_fees)])
+    sc += mp.sweep_fees(sp.some(sp.mutez(1))).run(sender = alice, valid = False)
+    sc += mp.sweep_fees(sp.some(sp.mutez(1))).run(sender = admin)
+    sc += mp.sweep_fees(sp.none).run(sender = admin)
+    sc.verify(mp.data.accrued_fees == sp.mutez(0))
+    sc += mp.sweep_fees(sp.some(sp.mutez(1))).run(sender = admin, valid = False)
+
+    sc.h1("Marketplace: Buy Floor")
+    sc.p("Bob lists below the floor and then moves his editions away; buy_floor skips his ask.")
+    sc += mp.ask(sp.record(
+        creator = bob,
+        token = sp.record(address = fa2.address, token_id = sp.nat(0)),
+        amount = sp.tez(1),
+        editions = sp.nat(1),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )).run(sender = bob)
+    sc += fa2.transfer([Batch_transfer.item(from_ = bob,
+                                            txs = [sp.record(to_ = mark, amount = 4, token_id = 0)])]).run(sender = bob)
+    sc += mp.buy_floor(token = sp.record(address = fa2.address, token_id = sp.nat(0)), max_price = sp.tez(3)).run(sender = elon, amount = sp.tez(5), valid = False)
+    sc += mp.buy_floor(token = sp.record(address = fa2.address, token_id = sp.nat(0)), max_price = sp.tez(5)).run(sender = elon, amount = sp.tez(5))
+    sc.verify(mp.data.asks[3].editions == 1)
+    sc.verify(mp.data.asks[4].editions == 1)
+
+    sc.h1("Marketplace: Expiry")
+    expiring_offer = sp.record(
+        creator = elon,
+        token = sp.record(
+            address = fa2.address,
+            token_id = sp.nat(0)
+        ),
+        amount = sp.tez(1),
+        quantity = sp.nat(1),
+        use_deposit = sp.bool(False),
+        expiry_time = sp.some(sp.timestamp(100)),
+        share_profile_id = sp.nat(0)
+    )
+    sc += mp.offer(expiring_offer).run(sender = elon, amount = sp.tez(1))
+    sc += mp.fulfill_offer(offer_id = sp.nat(5), quantity = sp.nat(1)).run(sender = alice, now = sp.timestamp(200), valid = False)
+    sc += mp.sweep_expired(bucket = sp.nat(0), page = sp.nat(0), max_items = sp.nat(10)).run(sender = bob, now = sp.timestamp(200))
+    sc.verify(~ mp.data.offers.contains(5))
+    sc.verify(~ mp.data.offer_expiries.contains(sp.pair(0, 0)))
+    sc.verify(~ mp.data.ask_expiries.contains(sp.pair(0, 0)))
+
+    sc.h1("Marketplace: Deposit-backed Offers")
+    deposit_offer = sp.record(
+        creator = elon,
+        token = sp.record(
+            address = fa2.address,
+            token_id = sp.nat(0)
+        ),
+        amount = sp.tez(1),
+        quantity = sp.nat(2),
+        use_deposit = sp.bool(True),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )
+    sc += mp.offer(deposit_offer).run(sender = elon, valid = False)
+    sc += mp.deposit().run(sender = elon, amount = sp.tez(3))
+    sc += mp.offer(deposit_offer).run(sender = elon, amount = sp.tez(2), valid = False)
+    sc += mp.offer(deposit_offer).run(sender = bob, valid = False)
+    sc += mp.offer(deposit_offer).run(sender = elon)
+    sc += mp.fulfill_offer(offer_id = sp.nat(6), quantity = sp.nat(1)).run(sender = alice)
+    sc.verify(mp.data.deposits[elon] == sp.tez(2))
+    sc += mp.withdraw_for([elon]).run(sender = bob)
+    sc.verify(mp.data.deposits[elon] == sp.tez(2))
+    sc += mp.retract_offer(sp.nat(6)).run(sender = elon)
+    sc.verify(mp.data.deposits[elon] == sp.tez(2))
+    sc += mp.withdraw_deposit(sp.tez(3)).run(sender = elon, valid = False)
+    sc += mp.withdraw_deposit(sp.tez(1)).run(sender = elon)
+    sc.verify(mp.data.deposits[elon] == sp.tez(1))
+
+    sc.h2("Unfunded offers are skipped by accept_best_offer")
+    deposit_offer = sp.record(
+        creator = elon,
+        token = sp.record(
+            address = fa2.address,
+            token_id = sp.nat(0)
+        ),
+        amount = sp.tez(1),
+        quantity = sp.nat(1),
+        use_deposit = sp.bool(True),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )
+    sc += mp.offer(deposit_offer).run(sender = elon)
+    escrowed_offer = sp.record(
+        creator = bob,
+        token = sp.record(
+            address = fa2.address,
+            token_id = sp.nat(0)
+        ),
+        amount = sp.mutez(500000),
+        quantity = sp.nat(1),
+        use_deposit = sp.bool(False),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
+    )
+    sc += mp.offer(escrowed_offer).run(sender = bob, amount = sp.mutez(500000))
+    sc += mp.withdraw_deposit(sp.tez(1)).run(sender = elon)
+    sc += mp.accept_best_offer(token = sp.record(address = fa2.address, token_id = sp.nat(0)), min_amount = sp.mutez(500000)).run(sender = alice)
+    sc.verify(mp.data.offers.contains(7))
+    sc.verify(~ mp.data.offers.contains(8))
\ No newline at end of file
@@ -0,0 +1,135 @@
+import smartpy as sp
+
+Events = sp.io.import_script_from_url('file:./Events.py')
+
+# Settlement helpers shared by the Marketplace and Auction contracts.
+#
+# The platform fee is taken first and accrued in the contract until it is
+# swept, then the royalties recorded by the FA2 contract and every extra
+# share are taken from what is left, and the seller receives the remainder.
+# Each split is computed once, recipients listed several times are paid in a
+# single transfer and zero amounts are never sent.
+
+t_share = sp.TRecord(
+    recipient=sp.TAddress,
+    amount=sp.TNat)
+
+def add(payouts, recipient, amount):
+    sp.if amount > sp.mutez(0):
+        payouts.value[recipient] = payouts.value.get(recipient, sp.mutez(0)) + amount
+
+def royalties(token):
+    shares = sp.local("royalties", sp.list(t = t_share))
+    view = sp.local("royalties_view", sp.view("get_royalties", token.address, token.token_id, t = sp.TList(t_share)))
+    sp.if view.value.is_some():
+        shares.value = view.value.open_some()
+    return shares.value
+
+def split(data, amount, token, seller, shares = None):
+    payouts = sp.local("payouts", sp.map(tkey = sp.TAddress, tvalue = sp.TMutez))
+    fee = sp.local("payout_fee", sp.split_tokens(amount, data.platform_fees, 1000000))
+    remaining = sp.local("payout_remaining", amount - fee.value)
+    cut = sp.local("payout_cut", sp.mutez(0))
+    def take(txn):
+        cut.value = sp.split_tokens(remaining.value, txn.amount, 1000000)
+        add(payouts, txn.recipient, cut.value)
+        remaining.value = remaining.value - cut.value
+    sp.for txn in royalties(token):
+        take(txn)
+    if shares is not None:
+        sp.for txn in shares:
+            take(txn)
+    add(payouts, seller, remaining.value)
+    return sp.record(fee = fee.value, payouts = payouts.value)
+
+def send(data, payouts):
+    sp.if data.accrue_payouts:
+        sp.for payout in payouts.items():
+            data.balances[payout.key] = data.balances.get(payout.key, sp.mutez(0)) + payout.value
+    sp.else:
+        sp.for payout in payouts.items():
+            sp.send(payout.key, payout.value)
+
+def refund(data, recipient, amount):
+    # Returns escrowed tez, credited like payouts when they accrue so that a
+    # recipient rejecting tez cannot block the call.
+    sp.if data.accrue_payouts:
+        data.balances[recipient] = data.balances.get(recipient, sp.mutez(0)) + amount
+    sp.else:
+        sp.send(recipient, amount)
+
+def pay_out(data, amount, token, seller, shares = None):
+    payout = sp.local("payout", split(data, amount, token, seller, shares))
+    data.accrued_fees += payout.value.fee
+    send(data, payout.value.payouts)
+    return payout.value
+
+def sweep_fees(data, amount):
+    swept = sp.local("swept", data.accrued_fees)
+    sp.if amount.is_some():
+        swept.value = amount.open_some()
+    sp.verify(swept.value <= data.accrued_fees, "INSUFFICIENT_FEES")
+    data.accrued_fees -= swept.value
+    sp.if swept.value > sp.mutez(0):
+        sp.send(data.fund_operator, swept.value)
+    Events.funds("FEES_SWEPT", data.fund_operator, swept.value)
+
+def withdraw(data, recipient):
+    balance = sp.local("balance", data.balances.get_opt(recipient))
+    sp.if balance.value.is_some():
+        sp.send(recipient, balance.value.open_some())
+        Events.funds("WITHDRAWN", recipient, balance.value.open_some())
+        del data.balances[recipient]
+
+
+class Payout_benchmark(sp.Contract):
+    def __init__(self, fund_operator):
+        self.init(
+            fund_operator = fund_operator,
+            token = sp.record(address = sp.self_address, token_id = sp.nat(0)),
+            platform_fees = sp.nat(20000),
+            accrued_fees = sp.mutez(0),
+            balances = sp.big_map(tkey = sp.TAddress, tvalue = sp.TMutez),
+            accrue_payouts = sp.bool(False)
+        )
+
+    @sp.entry_point
+    def legacy(self, shares):
+        sp.set_type(shares, sp.TList(t_share))
+        transfer_amount = sp.local("transfer_amount", sp.amount)
+        # The fee is accrued as in `pay_out`, so that both entry points
+        # differ only in how the shares are paid.
+        self.data.accrued_fees += sp.split_tokens(transfer_amount.value, self.data.platform_fees, 1000000)
+        transfer_amount.value = transfer_amount.value - sp.split_tokens(transfer_amount.value, self.data.platform_fees, 1000000)
+        sp.for txn in shares:
+            sp.send(txn.recipient, sp.split_tokens(transfer_amount.value, txn.amount, 1000000))
+            transfer_amount.value = transfer_amount.value - sp.split_tokens(transfer_amount.value, txn.amount, 1000000)
+        sp.send(sp.sender, transfer_amount.value)
+
+    @sp.entry_point
+    def single_pass(self, shares):
+        sp.set_type(shares, sp.TList(t_share))
+        pay_out(self.data, sp.amount, self.data.token, sp.sender, shares)
+
+
+@sp.add_test(name="Payout")
+def test():
+    sc = sp.test_scenario()
+    sc.h1("Payout: legacy loop vs single pass")
+    sc.table_of_contents()
+    seller          =   sp.address("tz1ooSELLER")
+    fund_operator   =   sp.address("tz1ooFUNDoOP")
+    recipients      =   [sp.address("tz1ooARTIST"), sp.address("tz1ooCURATOR"), sp.address("tz1ooGALLERY")]
+
+    c = Payout_benchmark(fund_operator = fund_operator)
+    sc += c
+
+    for count in [1, 5, 20]:
+        sc.h2("%d shares" % count)
+        shares = [sp.record(recipient = recipients[i % len(recipients)], amount = sp.nat(10000))
+                  for i in range(count)]
+        sc.h3("Legacy loop: %d operations" % (count + 1))
+        sc += c.legacy(shares).run(sender = seller, amount = sp.tez(10))
+        sc.h3("Single pass: %d operations" % (min(count, len(recipients)) + 1))
+        sc += c.single_pass(shares).run(sender = seller, amount = sp.tez(10))
+    sc.verify(c.data.accrued_fees == sp.mutez(1200000))
@@ -0,0 +1,39 @@
+import smartpy as sp
+
+# Per-collection sale statistics shared by the Marketplace and Auction
+# contracts.
+#
+# Every sale updates the record of its FA2 contract in constant time: the
+# last unit price, an exponentially weighted average of the unit prices,
+# the cumulative volume and the number of editions sold. A fill of several
+# editions counts as a single observation of the average.
+
+t_stats = sp.TRecord(
+    last_price = sp.TMutez,
+    average_price = sp.TMutez,
+    volume = sp.TMutez,
+    sales = sp.TNat
+).right_comb()
+
+# Weight of the newest sale in the average, in millionths.
+average_weight = 100000
+
+def empty():
+    return sp.record(
+        last_price = sp.mutez(0),
+        average_price = sp.mutez(0),
+        volume = sp.mutez(0),
+        sales = sp.nat(0)
+    )
+
+def record_sale(stats, address, price, quantity):
+    entry = sp.local("collection_stats", stats.get(address, empty()))
+    sp.if entry.value.sales == 0:
+        entry.value.average_price = price
+    sp.else:
+        entry.value.average_price = (sp.split_tokens(entry.value.average_price, 1000000 - average_weight, 1000000)
+                                     + sp.split_tokens(price, average_weight, 1000000))
+    entry.value.last_price = price
+    entry.value.volume += sp.split_tokens(price, quantity, 1)
+    entry.value.sales += quantity
+    stats[address] = entry.value
@@ -94,12 +94,14 @@ def test():
                 amount=1,
                 metadata=sp.map({"": sp.utils.bytes_of_string(
                     "https://ipfs.io/ipfs/bafyreias7kz2ryktu34afqwh56pltm32uxsecaxsootklwlsquw5gn3ptq/metadata.json/")}),
+                royalties=[],
                 token_id=0).run(sender=Addr.admin)
     
     fa2_2.mint(address=Addr.bob,
                 amount=15,
                 metadata=sp.map({"": sp.utils.bytes_of_string(
                     "https://ipfs.io/ipfs/bafyreias7kz2ryktu34afqwh56pltm32uxsecaxsootklwlsquw5gn3ptq/metadata.json/")}),
+                royalties=[],
                 token_id=0).run(sender=Addr.admin)
     
     sc.h1("Part 1:- Testing Offers part in Marketplace Contract")
@@ -111,7 +113,10 @@ def test():
             token_id = sp.nat(0)
         ),
         amount = sp.tez(5),
-        expiry_time = sp.none
+        quantity = sp.nat(1),
+        use_deposit = sp.bool(False),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
     )
     sc += mp.offer(offer_data).run(sender = Addr.elon, amount = sp.tez(5))
     
@@ -123,7 +128,7 @@ def test():
                     operator=mp.address,
                     token_id=0))]).run(sender= Addr.alice)
     sc.h3(">> Marketplace Call: Alice accepts offer of Elon")
-    sc += mp.fulfill_offer(sp.nat(0)).run(sender = Addr.alice)
+    sc += mp.fulfill_offer(offer_id = sp.nat(0), quantity = sp.nat(1)).run(sender = Addr.alice)
     
     sc.h3(">> Tests: Verify data and check storage")
     sc.show(mp.data)
@@ -138,7 +143,10 @@ def test():
             token_id = sp.nat(0)
         ),
         amount = sp.tez(5),
-        expiry_time = sp.none
+        quantity = sp.nat(1),
+        use_deposit = sp.bool(False),
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
     )
     sc += mp.offer(offer_data).run(sender = Addr.elon, amount = sp.tez(5))
     
@@ -150,7 +158,7 @@ def test():
                     operator=mp.address,
                     token_id=0))]).run(sender= Addr.alice)
     sc.h3(">> Marketplace Call: Alice accepts offer of Elon")
-    sc += mp.fulfill_offer(sp.nat(1)).run(sender = Addr.alice, valid = False)
+    sc += mp.fulfill_offer(offer_id = sp.nat(1), quantity = sp.nat(1)).run(sender = Addr.alice, valid = False)
 
     sc.h3(">> Tests: Verify data and check storage")
     sc.verify((mp.data.offers).contains(1))     # Checks if storage contains the offer data
@@ -185,12 +193,13 @@ def test():
         ),
         amount = sp.tez(12),
         editions = sp.nat(5),
-        expiry_time = sp.none
+        expiry_time = sp.none,
+        share_profile_id = sp.nat(0)
     )
     sc += mp.ask(ask_data).run(sender = Addr.bob)
     
     sc.h2("> Mark Accepts Bobs Ask")
-    sc += mp.fulfill_ask(sp.nat(0)).run(sender = Addr.mark, amount = sp.tez(12))
+    sc += mp.fulfill_ask(ask_id = sp.nat(0), quantity = sp.nat(1)).run(sender = Addr.mark, amount = sp.tez(12))
     
     sc.h3(">> Tests: Verify data and check storage")
     sc.show(mp.data)
@@ -209,8 +218,7 @@ def test():
             start_time = sp.timestamp(0),
             end_time = sp.timestamp(10),
             price_increment = sp.tez(1),
-            current_price = sp.tez(0),
-            highest_bidder = Addr.bob
+            current_price = sp.tez(0)
         )
     
     sc.h3(">> FA2 Call: Bob makes Auction contract an Operator")